@@ -11,6 +11,7 @@ setup(
     long_description_content_type="text/markdown",
     url="https://github.com/yourusername/web-inference",
     packages=find_packages(),
+    package_data={"src": ["browser_scripts/*.js"]},
     classifiers=[
         "Development Status :: 3 - Alpha",
         "Intended Audience :: Developers",
@@ -27,12 +28,17 @@ setup(
         "playwright>=1.40.0",
         "beautifulsoup4>=4.12.0",
         "pydantic>=2.5.0",
+        "pydantic-settings>=2.1.0",
         "rich>=13.7.0",
         "click>=8.1.7",
     ],
     extras_require={
         "openai": ["openai>=1.6.0"],
-        "anthropic": ["anthropic>=0.8.0"],
+        "anthropic": ["anthropic>=0.40.0"],
+        "groq": ["groq>=0.4.0"],
+        "ollama": ["httpx>=0.25.0"],
+        "speedups": ["orjson>=3.9.0"],
+        "lenient-json": ["json5>=0.9.0"],
         "dev": ["pytest>=7.4.3", "black>=23.12.0", "flake8>=6.1.0"],
     },
     entry_points={
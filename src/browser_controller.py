@@ -2,13 +2,114 @@
 Enhanced Browser Controller with Analysis Controls
 """
 import asyncio
-from typing import Optional, Dict, List, Any
-from playwright.async_api import Page, ElementHandle
-import json
+import inspect
+import os
+import types
+from pathlib import Path
+from typing import Optional, Dict, List, Any, Tuple, Callable, Awaitable
+from playwright.async_api import Page, Frame, ElementHandle, JSHandle
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Page-side overlay API, evaluated at document start of every navigation.
+# Read once at import; it is registered per page and never changes.
+OVERLAY_JS_PATH = Path(__file__).parent / "browser_scripts" / "overlay.js"
+OVERLAY_JS = OVERLAY_JS_PATH.read_text(encoding="utf-8")
+
+# Static control panel markup; per-page values are set by api.mount()
+CONTROL_HTML = """
+    <div id="web-inference-controls">
+        <!-- Status Badge -->
+        <div id="wi-status">
+            <div id="wi-status-dot"></div>
+            <span id="wi-status-text"></span>
+        </div>
+        
+        <!-- Control Buttons -->
+        <div class="wi-buttons">
+            <button id="wi-analyze-btn" class="wi-btn"></button>
+            <button id="wi-clear-btn" class="wi-btn">Clear</button>
+            <button id="wi-toggle-btn" class="wi-btn">Hide</button>
+        </div>
+        
+        <!-- Clear Confirmation -->
+        <div id="wi-confirm">
+            <span>Clear all analysis overlays?</span>
+            <button id="wi-confirm-yes" class="wi-btn">Yes</button>
+            <button id="wi-confirm-no" class="wi-btn">No</button>
+        </div>
+        
+        <!-- Stats -->
+        <div id="wi-stats">
+            <div>Elements analyzed: <span id="wi-stat-elements">0</span></div>
+            <div>From cache: <span id="wi-stat-cache">0</span></div>
+            <div>New analyses: <span id="wi-stat-new">0</span></div>
+        </div>
+    </div>
+    """
+
+
+def _patch_playwright():
+    """Stop Playwright from walking the Python stack on every API call
+    
+    playwright-python calls inspect.stack() for each protocol message to attach
+    caller file/line info, and for the many small evaluate calls this controller
+    makes that walk dominates CPU time. The patch only drops that debug info
+    from Playwright's error messages. Newer releases walk frames directly via
+    inspect.currentframe(), so the patch is skipped unless the connection
+    module still calls inspect.stack(). Disable with WI_FAST_PLAYWRIGHT=0.
+    """
+    try:
+        from playwright._impl import _connection
+    except ImportError:
+        logger.debug("Playwright internals not found, skipping stack patch")
+        return
+
+    if getattr(_connection, "inspect", None) is not inspect:
+        logger.debug("Playwright connection does not import inspect, skipping stack patch")
+        return
+    try:
+        source = inspect.getsource(_connection)
+    except (OSError, TypeError):
+        logger.debug("Playwright connection source unavailable, skipping stack patch")
+        return
+    if "inspect.stack(" not in source:
+        logger.debug("Playwright does not capture stacks via inspect.stack(), skipping stack patch")
+        return
+
+    # Swap the module's view of `inspect` rather than the global module
+    fast_inspect = types.SimpleNamespace(**vars(inspect))
+    fast_inspect.stack = lambda *args, **kwargs: []
+    _connection.inspect = fast_inspect
+
+
+if os.getenv("WI_FAST_PLAYWRIGHT", "1") == "1":
+    _patch_playwright()
+
+
+# Analysis fields the page side renders; everything else stays in Python
+OVERLAY_ANALYSIS_FIELDS = (
+    'understanding', 'purpose', 'user_intent', 'confidence',
+    'key_elements', 'click_behavior'
+)
+
+# (lower bound, class suffix, color) bands, highest first; a confidence falls
+# in the first band whose bound it strictly exceeds
+CONFIDENCE_BANDS = (
+    (0.8, "high", "rgba(76, 175, 80, 0.6)"),  # Green
+    (0.5, "mid", "rgba(255, 193, 7, 0.6)"),  # Amber
+    (float("-inf"), "low", "rgba(244, 67, 54, 0.4)"),  # Red
+)
+
+
+def _confidence_band(confidence: float) -> Tuple[float, str, str]:
+    """Look up the confidence band for a score"""
+    for band in CONFIDENCE_BANDS:
+        if confidence > band[0]:
+            return band
+    return CONFIDENCE_BANDS[-1]
+
 
 class BrowserWithControls:
     """Browser controller with overlay controls and knowledge integration"""
@@ -17,314 +118,146 @@ class BrowserWithControls:
         self.page = page
         self.current_url = None
         self.is_analyzing = False
+        self._overlay_seq = 0  # Source of unique data-wi-id values
+        self._overlay_api: Optional[JSHandle] = None  # Cached handle to window.__wi
+        self._attached = False
+        self._ui_handlers: Dict[str, List[Callable[[], Awaitable[Any]]]] = {
+            'analyze': [self._handle_analyze_request],
+            'clear': [self._handle_clear_request]
+        }
+        self._ui_tasks = set()  # Keeps running handler tasks referenced
+        self.page.on('framenavigated', self._on_frame_navigated)
+    
+    async def attach(self):
+        """Register the overlay bootstrap script with the page
         
-    async def inject_control_overlay(self, has_cached_knowledge: bool = False):
-        """Inject the control overlay and status indicator"""
-        
-        control_html = """
-        <div id="web-inference-controls" style="
-            position: fixed;
-            top: 20px;
-            right: 20px;
-            z-index: 10000;
-            font-family: system-ui, -apple-system, sans-serif;
-        ">
-            <!-- Status Badge -->
-            <div id="wi-status" style="
-                background: rgba(0, 0, 0, 0.8);
-                color: white;
-                padding: 8px 16px;
-                border-radius: 20px;
-                margin-bottom: 10px;
-                font-size: 14px;
-                display: flex;
-                align-items: center;
-                gap: 8px;
-            ">
-                <div id="wi-status-dot" style="
-                    width: 8px;
-                    height: 8px;
-                    border-radius: 50%;
-                    background: %s;
-                "></div>
-                <span id="wi-status-text">%s</span>
-            </div>
-            
-            <!-- Control Buttons -->
-            <div style="display: flex; gap: 10px;">
-                <button id="wi-analyze-btn" style="
-                    background: #4CAF50;
-                    color: white;
-                    border: none;
-                    padding: 10px 20px;
-                    border-radius: 5px;
-                    cursor: pointer;
-                    font-weight: 500;
-                    transition: all 0.3s ease;
-                " onmouseover="this.style.background='#45a049'" 
-                   onmouseout="this.style.background='#4CAF50'">
-                    %s
-                </button>
-                
-                <button id="wi-clear-btn" style="
-                    background: #f44336;
-                    color: white;
-                    border: none;
-                    padding: 10px 20px;
-                    border-radius: 5px;
-                    cursor: pointer;
-                    font-weight: 500;
-                    transition: all 0.3s ease;
-                " onmouseover="this.style.background='#da190b'" 
-                   onmouseout="this.style.background='#f44336'">
-                    Clear
-                </button>
-                
-                <button id="wi-toggle-btn" style="
-                    background: #2196F3;
-                    color: white;
-                    border: none;
-                    padding: 10px 20px;
-                    border-radius: 5px;
-                    cursor: pointer;
-                    font-weight: 500;
-                    transition: all 0.3s ease;
-                " onmouseover="this.style.background='#0b7dda'" 
-                   onmouseout="this.style.background='#2196F3'">
-                    Hide
-                </button>
-            </div>
-            
-            <!-- Stats -->
-            <div id="wi-stats" style="
-                background: rgba(0, 0, 0, 0.8);
-                color: white;
-                padding: 10px;
-                border-radius: 5px;
-                margin-top: 10px;
-                font-size: 12px;
-                display: none;
-            ">
-                <div>Elements analyzed: <span id="wi-stat-elements">0</span></div>
-                <div>From cache: <span id="wi-stat-cache">0</span></div>
-                <div>New analyses: <span id="wi-stat-new">0</span></div>
-            </div>
-        </div>
-        """ % (
-            "#4CAF50" if has_cached_knowledge else "#ff9800",  # Green if cached, orange if not
-            "Knowledge loaded" if has_cached_knowledge else "No prior analysis",
-            "Re-analyze" if has_cached_knowledge else "Analyze Page"
+        The init script runs at the start of every later navigation; the
+        document that is already loaded gets it evaluated once directly
+        (skipped for the initial blank page, where nothing needs it).
+        The UI event binding is page-wide, so it is also exposed only here.
+        """
+        if self._attached:
+            return
+        await asyncio.gather(
+            self.page.expose_function('__wiFlushEvents', self._dispatch_ui_events),
+            self.page.add_init_script(script=OVERLAY_JS)
         )
+        if self.page.url != 'about:blank':
+            await self.page.evaluate(OVERLAY_JS)
+        self._attached = True
         
-        # Inject the control overlay
-        await self.page.evaluate(f"""
-            (() => {{
-                // Remove existing controls if any
-                const existing = document.getElementById('web-inference-controls');
-                if (existing) existing.remove();
-                
-                // Add new controls
-                const controls = document.createElement('div');
-                controls.innerHTML = `{control_html}`;
-                document.body.appendChild(controls.firstElementChild);
-                
-                // Initialize web inference state
-                window.webInferenceState = {{
-                    overlaysVisible: true,
-                    stats: {{
-                        elements: 0,
-                        cache: 0,
-                        new: 0
-                    }},
-                    overlays: new Map()
-                }};
-                
-                // Button handlers
-                document.getElementById('wi-analyze-btn').addEventListener('click', () => {{
-                    window.dispatchEvent(new CustomEvent('web-inference-analyze'));
-                }});
-                
-                document.getElementById('wi-clear-btn').addEventListener('click', () => {{
-                    if (confirm('Clear all analysis overlays?')) {{
-                        window.dispatchEvent(new CustomEvent('web-inference-clear'));
-                    }}
-                }});
-                
-                document.getElementById('wi-toggle-btn').addEventListener('click', () => {{
-                    window.webInferenceState.overlaysVisible = !window.webInferenceState.overlaysVisible;
-                    const visible = window.webInferenceState.overlaysVisible;
-                    
-                    // Toggle all overlays
-                    document.querySelectorAll('.wi-overlay').forEach(overlay => {{
-                        overlay.style.display = visible ? 'block' : 'none';
-                    }});
-                    
-                    // Update button text
-                    document.getElementById('wi-toggle-btn').textContent = visible ? 'Hide' : 'Show';
-                }});
-            }})();
-        """)
+    def _on_frame_navigated(self, frame: Frame):
+        """Drop the cached overlay API when the main frame loads a new document"""
+        if frame == self.page.main_frame:
+            self._overlay_api = None
+    
+    async def _get_overlay_api(self) -> JSHandle:
+        """Install the page-side overlay API once per document and cache its handle"""
+        if self._overlay_api is None:
+            await self.attach()
+            self._overlay_api = await self.page.evaluate_handle("() => window.__wiInstall()")
+        return self._overlay_api
         
-        # Set up event listeners
-        await self.page.expose_function('onAnalyzeRequest', self._handle_analyze_request)
-        await self.page.expose_function('onClearRequest', self._handle_clear_request)
+    async def inject_control_overlay(self, has_cached_knowledge: bool = False):
+        """Inject the control overlay and status indicator"""
         
-        await self.page.evaluate("""
-            window.addEventListener('web-inference-analyze', () => window.onAnalyzeRequest());
-            window.addEventListener('web-inference-clear', () => window.onClearRequest());
-        """)
+        # Inject the control overlay; per-page values travel as arguments
+        api = await self._get_overlay_api()
+        await api.evaluate("(api, args) => api.mount(args)", {
+            'html': CONTROL_HTML,
+            'status_color': "#4CAF50" if has_cached_knowledge else "#ff9800",  # Green if cached, orange if not
+            'status_text': "Knowledge loaded" if has_cached_knowledge else "No prior analysis",
+            'button_label': "Re-analyze" if has_cached_knowledge else "Analyze Page"
+        })
+    
+    def on_ui_event(self, event_type: str, handler: Callable[[], Awaitable[Any]]):
+        """Run handler whenever the overlay emits event_type ('analyze', 'clear')"""
+        self._ui_handlers.setdefault(event_type, []).append(handler)
+    
+    async def _dispatch_ui_events(self, events: List[Dict[str, Any]]):
+        """Hand a batch of overlay UI events to their registered handlers"""
+        for event in events:
+            for handler in self._ui_handlers.get(event['type'], []):
+                # Run as tasks so the binding call returns to the page immediately
+                task = asyncio.create_task(handler())
+                self._ui_tasks.add(task)
+                task.add_done_callback(self._ui_tasks.discard)
     
     async def update_status(self, text: str, color: str = "#4CAF50"):
         """Update the status indicator"""
-        await self.page.evaluate(f"""
-            (() => {{
-                const statusDot = document.getElementById('wi-status-dot');
-                const statusText = document.getElementById('wi-status-text');
-                if (statusDot && statusText) {{
-                    statusDot.style.background = '{color}';
-                    statusText.textContent = '{text}';
-                }}
-            }})();
-        """)
+        api = await self._get_overlay_api()
+        await api.evaluate(
+            "(api, args) => api.setStatus(args.text, args.color)",
+            {'text': text, 'color': color}
+        )
     
     async def update_stats(self, stats: Dict[str, int]):
         """Update the statistics display"""
-        await self.page.evaluate(f"""
-            (() => {{
-                document.getElementById('wi-stat-elements').textContent = '{stats.get("elements", 0)}';
-                document.getElementById('wi-stat-cache').textContent = '{stats.get("cache_hits", 0)}';
-                document.getElementById('wi-stat-new').textContent = '{stats.get("llm_calls", 0)}';
-                document.getElementById('wi-stats').style.display = 'block';
-            }})();
-        """)
+        api = await self._get_overlay_api()
+        await api.evaluate("(api, stats) => api.setStats(stats)", {
+            'elements': stats.get('elements', 0),
+            'cache_hits': stats.get('cache_hits', 0),
+            'llm_calls': stats.get('llm_calls', 0)
+        })
     
     async def create_element_overlay(self, element: ElementHandle, analysis: Dict[str, Any], from_cache: bool = False):
-        """Create overlay for an analyzed element"""
+        """Create overlay for a single analyzed element"""
+        await self.create_element_overlays([(element, analysis, from_cache)])
+    
+    async def create_element_overlays(self, items: List[Tuple[ElementHandle, Dict[str, Any], bool]],
+                                      version: Optional[str] = None):
+        """Create overlays for many analyzed elements in a single round-trip
         
-        color = self._get_confidence_color(analysis.get('confidence', 0))
-        cache_indicator = "📦" if from_cache else "✨"
+        Each item is an ``(element, analysis, from_cache)`` tuple. Element
+        handles travel inside the evaluate payload, so the whole batch costs
+        one CDP call; in the page all rects are read before any overlay is
+        attached, and the overlays go in with a single fragment append.
+        Only the analysis fields the page renders are sent. ``version`` tags
+        the page's overlay set; see ``overlay_version()``.
+        """
+        if not items:
+            return
         
-        await element.evaluate(f"""
-            (element) => {{
-                const rect = element.getBoundingClientRect();
-                
-                // Create overlay
-                const overlay = document.createElement('div');
-                overlay.className = 'wi-overlay';
-                overlay.style.cssText = `
-                    position: fixed;
-                    left: ${{rect.left}}px;
-                    top: ${{rect.top}}px;
-                    width: ${{rect.width}}px;
-                    height: ${{rect.height}}px;
-                    border: 2px solid {color};
-                    background: transparent;
-                    pointer-events: none;
-                    z-index: 9998;
-                    transition: all 0.3s ease;
-                `;
-                
-                // Add cache indicator
-                const indicator = document.createElement('div');
-                indicator.style.cssText = `
-                    position: absolute;
-                    top: -10px;
-                    right: -10px;
-                    background: {color};
-                    color: white;
-                    width: 20px;
-                    height: 20px;
-                    border-radius: 50%;
-                    display: flex;
-                    align-items: center;
-                    justify-content: center;
-                    font-size: 12px;
-                `;
-                indicator.textContent = '{cache_indicator}';
-                overlay.appendChild(indicator);
-                
-                document.body.appendChild(overlay);
-                
-                // Store overlay reference
-                window.webInferenceState.overlays.set(element, {{
-                    overlay: overlay,
-                    analysis: {json.dumps(analysis)}
-                }});
-                
-                // Update position on scroll/resize
-                const updatePosition = () => {{
-                    const newRect = element.getBoundingClientRect();
-                    overlay.style.left = newRect.left + 'px';
-                    overlay.style.top = newRect.top + 'px';
-                    overlay.style.width = newRect.width + 'px';
-                    overlay.style.height = newRect.height + 'px';
-                }};
-                
-                window.addEventListener('scroll', updatePosition);
-                window.addEventListener('resize', updatePosition);
-                
-                // Click handler for explanation
-                element.addEventListener('click', (e) => {{
-                    if (e.altKey) {{  // Alt+Click to see explanation
-                        e.preventDefault();
-                        e.stopPropagation();
-                        
-                        const modal = document.createElement('div');
-                        modal.style.cssText = `
-                            position: fixed;
-                            top: 50%;
-                            left: 50%;
-                            transform: translate(-50%, -50%);
-                            background: rgba(0, 0, 0, 0.95);
-                            color: white;
-                            padding: 30px;
-                            border-radius: 10px;
-                            z-index: 10001;
-                            max-width: 600px;
-                            font-family: system-ui;
-                        `;
-                        
-                        const analysis = window.webInferenceState.overlays.get(element).analysis;
-                        modal.innerHTML = `
-                            <h3 style="margin: 0 0 20px 0;">AI Understanding {cache_indicator}</h3>
-                            <p><strong>What this is:</strong> ${{analysis.understanding}}</p>
-                            <p><strong>Purpose:</strong> ${{analysis.purpose}}</p>
-                            <p><strong>Confidence:</strong> ${{(analysis.confidence * 100).toFixed(0)}}%</p>
-                            <button onclick="this.parentElement.remove()" 
-                                    style="background: #4CAF50; border: none; 
-                                           padding: 10px 20px; border-radius: 5px; 
-                                           cursor: pointer; margin-top: 20px;">
-                                Close
-                            </button>
-                        `;
-                        
-                        document.body.appendChild(modal);
-                        modal.addEventListener('click', (e) => {{
-                            if (e.target === modal) modal.remove();
-                        }});
-                    }}
-                }});
-            }}
-        """, element)
+        # Scores repeat heavily across a page, so resolve each distinct one once
+        levels = {}
+        payload = []
+        for element, analysis, from_cache in items:
+            confidence = analysis.get('confidence', 0)
+            if confidence not in levels:
+                levels[confidence] = self._get_confidence_level(confidence)
+            self._overlay_seq += 1
+            payload.append({
+                'id': self._overlay_seq,
+                'element': element,
+                'analysis': {key: analysis[key] for key in OVERLAY_ANALYSIS_FIELDS if key in analysis},
+                'level': levels[confidence],
+                'indicator': "📦" if from_cache else "✨"
+            })
+        
+        api = await self._get_overlay_api()
+        await api.evaluate(
+            "(api, args) => api.addOverlays(args.items, args.version)",
+            {'items': payload, 'version': version}
+        )
+    
+    async def overlay_version(self) -> Optional[str]:
+        """Version the current overlays were drawn with (None once cleared,
+        after unversioned additions, or on a fresh document)"""
+        api = await self._get_overlay_api()
+        return await api.evaluate("() => window.webInferenceState.overlayVersion")
+    
+    def _get_confidence_level(self, confidence: float) -> str:
+        """Get the wi-conf-* class suffix for a confidence level"""
+        return _confidence_band(confidence)[1]
     
     def _get_confidence_color(self, confidence: float) -> str:
         """Get color based on confidence level"""
-        if confidence > 0.8:
-            return "rgba(76, 175, 80, 0.6)"  # Green
-        elif confidence > 0.5:
-            return "rgba(255, 193, 7, 0.6)"  # Amber
-        else:
-            return "rgba(244, 67, 54, 0.4)"  # Red
+        return _confidence_band(confidence)[2]
     
     async def clear_overlays(self):
         """Clear all analysis overlays"""
-        await self.page.evaluate("""
-            (() => {
-                document.querySelectorAll('.wi-overlay').forEach(el => el.remove());
-                window.webInferenceState.overlays.clear();
-                window.webInferenceState.stats = { elements: 0, cache: 0, new: 0 };
-            })();
-        """)
+        api = await self._get_overlay_api()
+        await api.evaluate("(api) => api.clear()")
     
     async def _handle_analyze_request(self):
         """Handle request to analyze/re-analyze the page"""
@@ -0,0 +1,516 @@
+/*
+ * Web Inference page-side overlay API
+ *
+ * Registered with page.add_init_script, so it runs as a top-level script at
+ * the start of every document instead of as an eval'd string. Nothing touches
+ * the DOM until window.__wiInstall() is called; that sets up the stylesheet,
+ * state and listeners once per document and returns the API object that
+ * BrowserWithControls keeps a handle to.
+ */
+(() => {
+    if (window.__wiInstall) return;
+    
+    // Shared stylesheet for the controls and overlays, so each overlay only
+    // needs a className instead of its own inline style blob
+    const OVERLAY_CSS = `
+        #web-inference-controls {
+            position: fixed;
+            top: 20px;
+            right: 20px;
+            z-index: 10000;
+            font-family: system-ui, -apple-system, sans-serif;
+        }
+        #wi-status {
+            background: rgba(0, 0, 0, 0.8);
+            color: white;
+            padding: 8px 16px;
+            border-radius: 20px;
+            margin-bottom: 10px;
+            font-size: 14px;
+            display: flex;
+            align-items: center;
+            gap: 8px;
+        }
+        #wi-status-dot {
+            width: 8px;
+            height: 8px;
+            border-radius: 50%;
+        }
+        .wi-buttons {
+            display: flex;
+            gap: 10px;
+        }
+        .wi-btn {
+            color: white;
+            border: none;
+            padding: 10px 20px;
+            border-radius: 5px;
+            cursor: pointer;
+            font-weight: 500;
+            transition: all 0.3s ease;
+        }
+        #wi-analyze-btn { background: #4CAF50; }
+        #wi-analyze-btn:hover { background: #45a049; }
+        #wi-clear-btn { background: #f44336; }
+        #wi-clear-btn:hover { background: #da190b; }
+        #wi-toggle-btn { background: #2196F3; }
+        #wi-toggle-btn:hover { background: #0b7dda; }
+        #wi-confirm {
+            background: rgba(0, 0, 0, 0.8);
+            color: white;
+            padding: 10px;
+            border-radius: 5px;
+            margin-top: 10px;
+            font-size: 13px;
+            display: none;
+            align-items: center;
+            gap: 8px;
+        }
+        #wi-confirm.wi-open { display: flex; }
+        #wi-confirm .wi-btn { padding: 4px 12px; }
+        #wi-confirm-yes { background: #f44336; }
+        #wi-confirm-no { background: #757575; }
+        #wi-stats {
+            background: rgba(0, 0, 0, 0.8);
+            color: white;
+            padding: 10px;
+            border-radius: 5px;
+            margin-top: 10px;
+            font-size: 12px;
+            display: none;
+        }
+        
+        #wi-overlay-layer {
+            position: absolute;
+            left: 0;
+            top: 0;
+            width: 0;
+            height: 0;
+            z-index: 9998;
+        }
+        .wi-overlay {
+            position: absolute;
+            left: 0;
+            top: 0;
+            will-change: transform;
+            border: 2px solid;
+            background: transparent;
+            pointer-events: none;
+            z-index: 9998;
+            transition: border-color 0.3s ease, opacity 0.3s ease;
+            /* Keep each overlay's internal layout and counters out of the
+               page's layout/style passes. Not on the layer: containment would
+               turn it into the containing block for pinned overlays. */
+            contain: layout style;
+        }
+        .wi-overlay--pinned { position: fixed; }
+        .wi-indicator {
+            position: absolute;
+            top: -10px;
+            right: -10px;
+            color: white;
+            width: 20px;
+            height: 20px;
+            border-radius: 50%;
+            display: flex;
+            align-items: center;
+            justify-content: center;
+            font-size: 12px;
+        }
+        .wi-overlay.wi-conf-high { border-color: rgba(76, 175, 80, 0.6); }
+        .wi-overlay.wi-conf-mid { border-color: rgba(255, 193, 7, 0.6); }
+        .wi-overlay.wi-conf-low { border-color: rgba(244, 67, 54, 0.4); }
+        .wi-indicator.wi-conf-high { background: rgba(76, 175, 80, 0.6); }
+        .wi-indicator.wi-conf-mid { background: rgba(255, 193, 7, 0.6); }
+        .wi-indicator.wi-conf-low { background: rgba(244, 67, 54, 0.4); }
+        
+        .wi-modal {
+            position: fixed;
+            top: 50%;
+            left: 50%;
+            transform: translate(-50%, -50%);
+            background: rgba(0, 0, 0, 0.95);
+            color: white;
+            padding: 30px;
+            border-radius: 10px;
+            z-index: 10001;
+            max-width: 600px;
+            font-family: system-ui;
+        }
+        .wi-click-info {
+            position: absolute;
+            bottom: -20px;
+            left: 0;
+            background: rgba(33, 150, 243, 0.9);
+            color: white;
+            padding: 2px 6px;
+            border-radius: 3px;
+            font-size: 10px;
+            font-family: system-ui;
+            max-width: 200px;
+            white-space: nowrap;
+            overflow: hidden;
+            text-overflow: ellipsis;
+        }
+        .wi-modal h3 { margin: 0 0 20px 0; }
+        .wi-modal-close {
+            background: #4CAF50;
+            border: none;
+            padding: 10px 20px;
+            border-radius: 5px;
+            cursor: pointer;
+            margin-top: 20px;
+        }
+    `;
+    
+    window.__wiInstall = () => {
+        if (window.__wi) return window.__wi;
+        
+        const styles = document.createElement('style');
+        styles.id = 'wi-styles';
+        styles.textContent = OVERLAY_CSS;
+        document.head.appendChild(styles);
+        
+        // Initialize web inference state
+        window.webInferenceState = {
+            overlaysVisible: true,
+            stats: {
+                elements: 0,
+                cache: 0,
+                new: 0
+            },
+            // Element -> record lookups. A WeakMap, so elements the page
+            // removes can be collected even while we hold their analysis
+            overlays: new WeakMap(),
+            // Records to iterate when repositioning; they only reference
+            // their element through a WeakRef
+            records: new Set(),
+            // Snapshot hash of the run whose overlays are on the page, so the
+            // controller can tell they are still current without redrawing
+            overlayVersion: null
+        };
+        const state = window.webInferenceState;
+        
+        // Leveled batch processor: each animation frame runs every queued
+        // measure (layout reads) before every queued mutate (DOM writes), so
+        // work from different sources never interleaves reads and writes
+        const frame = {
+            measures: [],
+            mutates: [],
+            scheduled: false,
+            measure(fn) {
+                frame.measures.push(fn);
+                frame.schedule();
+            },
+            mutate(fn) {
+                frame.mutates.push(fn);
+                frame.schedule();
+            },
+            schedule() {
+                if (frame.scheduled) return;
+                frame.scheduled = true;
+                requestAnimationFrame(frame.flush);
+            },
+            flush() {
+                frame.measures.splice(0).forEach(fn => fn());
+                // Mutates queued by the measures above still run this frame
+                frame.scheduled = false;
+                frame.mutates.splice(0).forEach(fn => fn());
+            }
+        };
+        state.frame = frame;
+        
+        // Overlays sit in document coordinates, so plain scrolling needs no
+        // work. Only targets inside fixed/sticky boxes ("pinned") follow the
+        // viewport and are re-read on scroll; everything else is re-read when
+        // an observer reports that layout may have changed.
+        state.pinnedCount = 0;
+        let pendingUpdate = null;  // null, 'pinned' or 'all'
+        
+        // Reposition on-screen overlays: rect reads in the measure level,
+        // style writes in the mutate level, at most once per animation frame
+        state.updateAll = () => {
+            const pinnedOnly = pendingUpdate === 'pinned';
+            pendingUpdate = null;
+            const entries = [];
+            const stale = [];
+            state.records.forEach(record => {
+                const element = record.target.deref();
+                if (!element || !element.isConnected) {
+                    stale.push(record);
+                } else if (record.onScreen && (record.pinned || !pinnedOnly)) {
+                    entries.push([element, record]);
+                }
+            });
+            const scrollX = window.scrollX;
+            const scrollY = window.scrollY;
+            const rects = entries.map(([element]) => element.getBoundingClientRect());
+            frame.mutate(() => {
+                entries.forEach(([, record], i) => {
+                    const rect = rects[i];
+                    const style = record.overlay.style;
+                    const x = rect.left + (record.pinned ? 0 : scrollX);
+                    const y = rect.top + (record.pinned ? 0 : scrollY);
+                    // Moves are compositor-only; size writes (which relayout the
+                    // overlay) only happen when the target actually resized
+                    style.transform = `translate(${x}px, ${y}px)`;
+                    if (rect.width !== record.width || rect.height !== record.height) {
+                        record.width = rect.width;
+                        record.height = rect.height;
+                        style.width = rect.width + 'px';
+                        style.height = rect.height + 'px';
+                    }
+                });
+                stale.forEach(forgetRecord);
+            });
+        };
+        const scheduleUpdate = (scope = 'all') => {
+            if (pendingUpdate === 'all') return;
+            if (pendingUpdate === null) frame.measure(state.updateAll);
+            pendingUpdate = scope;
+        };
+        window.addEventListener('scroll', () => {
+            if (state.pinnedCount) scheduleUpdate('pinned');
+        }, { passive: true });
+        window.addEventListener('resize', () => scheduleUpdate(), { passive: true });
+        
+        // Tracked boxes changing size, or the DOM around them changing
+        state.resizes = new ResizeObserver(() => scheduleUpdate());
+        state.mutations = new MutationObserver(() => scheduleUpdate());
+        
+        // Drop the overlay of an element the page has removed
+        const forgetRecord = (record) => {
+            const element = record.target.deref();
+            if (element) {
+                state.visibility.unobserve(element);
+                state.resizes.unobserve(element);
+            }
+            if (record.pinned) state.pinnedCount--;
+            record.overlay.remove();
+            state.records.delete(record);
+        };
+        
+        const isPinned = (element) => {
+            for (let node = element; node && node !== document.body; node = node.parentElement) {
+                const position = getComputedStyle(node).position;
+                if (position === 'fixed' || position === 'sticky') return true;
+            }
+            return false;
+        };
+        
+        // Offscreen elements are hidden and skipped until they scroll back in
+        state.visibility = new IntersectionObserver((entries) => {
+            entries.forEach(entry => {
+                const record = state.overlays.get(entry.target);
+                if (!record) return;
+                record.onScreen = entry.isIntersecting;
+                frame.mutate(() => {
+                    record.overlay.style.visibility = entry.isIntersecting ? '' : 'hidden';
+                });
+            });
+            scheduleUpdate();
+        });
+        
+        // Alt+Click on any analyzed element shows its explanation. One
+        // capturing listener on the document replaces a listener per element.
+        const showModal = (record) => {
+            const analysis = record.analysis;
+            const modal = document.createElement('div');
+            modal.className = 'wi-modal';
+            modal.innerHTML = `
+                <h3>AI Understanding ${record.indicator}</h3>
+                <p><strong>What this is:</strong> ${analysis.understanding}</p>
+                <p><strong>Purpose:</strong> ${analysis.purpose}</p>
+                ${analysis.user_intent ? `<p><strong>User intent:</strong> ${analysis.user_intent}</p>` : ''}
+                ${analysis.click_behavior ? `<p><strong>Click behavior:</strong> ${analysis.click_behavior}</p>` : ''}
+                <p><strong>Confidence:</strong> ${(analysis.confidence * 100).toFixed(0)}%</p>
+                ${analysis.key_elements ? `<p><strong>Key features:</strong> ${analysis.key_elements.join(', ')}</p>` : ''}
+                <button class="wi-modal-close">Close</button>
+            `;
+            
+            document.body.appendChild(modal);
+            modal.addEventListener('click', (e) => {
+                if (e.target === modal || e.target.closest('.wi-modal-close')) modal.remove();
+            });
+        };
+        document.addEventListener('click', (e) => {
+            if (!e.altKey) return;
+            const element = e.target.closest('[data-wi-id]');
+            const record = element && state.overlays.get(element);
+            if (!record) return;
+            e.preventDefault();
+            e.stopPropagation();
+            showModal(record);
+        }, true);
+        
+        // UI events queue up and reach Python through a single binding call
+        // per frame, however many of them fired in between
+        const pendingEvents = [];
+        const flushEvents = () => {
+            const events = pendingEvents.splice(0);
+            if (window.__wiFlushEvents) window.__wiFlushEvents(events);
+        };
+        
+        const api = {
+            emit(type, detail = {}) {
+                if (!pendingEvents.length) requestAnimationFrame(flushEvents);
+                pendingEvents.push({ type, detail });
+            },
+            
+            mount(args) {
+                // Remove existing controls if any
+                const existing = document.getElementById('web-inference-controls');
+                if (existing) existing.remove();
+                
+                // Add new controls
+                const controls = document.createElement('div');
+                controls.innerHTML = args.html;
+                document.body.appendChild(controls.firstElementChild);
+                document.getElementById('wi-analyze-btn').textContent = args.button_label;
+                api.setStatus(args.status_text, args.status_color);
+                
+                // Button handlers
+                document.getElementById('wi-analyze-btn').addEventListener('click', () => {
+                    api.emit('analyze');
+                });
+                
+                // Inline confirmation rather than confirm(), which would block
+                // the page and every Playwright call queued behind it
+                const confirmBox = document.getElementById('wi-confirm');
+                document.getElementById('wi-clear-btn').addEventListener('click', () => {
+                    confirmBox.classList.add('wi-open');
+                });
+                
+                document.getElementById('wi-confirm-yes').addEventListener('click', () => {
+                    confirmBox.classList.remove('wi-open');
+                    api.emit('clear');
+                });
+                
+                document.getElementById('wi-confirm-no').addEventListener('click', () => {
+                    confirmBox.classList.remove('wi-open');
+                });
+                
+                document.getElementById('wi-toggle-btn').addEventListener('click', () => {
+                    window.webInferenceState.overlaysVisible = !window.webInferenceState.overlaysVisible;
+                    const visible = window.webInferenceState.overlaysVisible;
+                    
+                    // Toggle all overlays with a single write on their layer
+                    if (state.layer) state.layer.style.display = visible ? '' : 'none';
+                    
+                    // Update button text
+                    document.getElementById('wi-toggle-btn').textContent = visible ? 'Hide' : 'Show';
+                });
+            },
+            
+            setStatus(text, color) {
+                const statusDot = document.getElementById('wi-status-dot');
+                const statusText = document.getElementById('wi-status-text');
+                if (statusDot && statusText) {
+                    statusDot.style.background = color;
+                    statusText.textContent = text;
+                }
+            },
+            
+            setStats(stats) {
+                document.getElementById('wi-stat-elements').textContent = stats.elements;
+                document.getElementById('wi-stat-cache').textContent = stats.cache_hits;
+                document.getElementById('wi-stat-new').textContent = stats.llm_calls;
+                document.getElementById('wi-stats').style.display = 'block';
+            },
+            
+            getLayer() {
+                // All overlays live in one container anchored to the document
+                // origin, so adding, clearing or hiding them is a single DOM write
+                if (!state.layer || !state.layer.isConnected) {
+                    state.layer = document.createElement('div');
+                    state.layer.id = 'wi-overlay-layer';
+                    if (!state.overlaysVisible) state.layer.style.display = 'none';
+                    document.documentElement.appendChild(state.layer);
+                }
+                return state.layer;
+            },
+            
+            addOverlays(items, version) {
+                // Read phase: every layout read happens before any DOM write
+                const rects = items.map(item => item.element.getBoundingClientRect());
+                const pinned = items.map(item => isPinned(item.element));
+                const scrollX = window.scrollX;
+                const scrollY = window.scrollY;
+                
+                // Write phase: build overlays detached, then attach them once
+                const fragment = document.createDocumentFragment();
+                items.forEach((item, i) => {
+                    const element = item.element;
+                    const rect = rects[i];
+                    element.setAttribute('data-wi-id', item.id);
+                    
+                    // Create overlay
+                    const overlay = document.createElement('div');
+                    overlay.className = `wi-overlay wi-conf-${item.level}` +
+                        (pinned[i] ? ' wi-overlay--pinned' : '');
+                    overlay.style.transform =
+                        `translate(${rect.left + (pinned[i] ? 0 : scrollX)}px, ${rect.top + (pinned[i] ? 0 : scrollY)}px)`;
+                    overlay.style.width = rect.width + 'px';
+                    overlay.style.height = rect.height + 'px';
+                    
+                    // Add cache indicator
+                    const indicator = document.createElement('div');
+                    indicator.className = `wi-indicator wi-conf-${item.level}`;
+                    indicator.textContent = item.indicator;
+                    overlay.appendChild(indicator);
+                    
+                    // Say what clicking a clickable element does
+                    if (item.analysis.click_behavior) {
+                        const clickInfo = document.createElement('div');
+                        clickInfo.className = 'wi-click-info';
+                        clickInfo.textContent = '→ ' + item.analysis.click_behavior;
+                        overlay.appendChild(clickInfo);
+                    }
+                    fragment.appendChild(overlay);
+                    
+                    // Store overlay reference
+                    const record = {
+                        target: new WeakRef(element),
+                        overlay: overlay,
+                        analysis: item.analysis,
+                        onScreen: true,
+                        pinned: pinned[i],
+                        width: rect.width,
+                        height: rect.height,
+                        indicator: item.indicator
+                    };
+                    state.overlays.set(element, record);
+                    state.records.add(record);
+                    if (pinned[i]) state.pinnedCount++;
+                    state.visibility.observe(element);
+                    state.resizes.observe(element);
+                });
+                
+                api.getLayer().appendChild(fragment);
+                state.mutations.observe(document.body, { childList: true, subtree: true });
+                // Overlays added outside a versioned batch make the set unknown
+                state.overlayVersion = version || null;
+            },
+            
+            clear() {
+                if (state.layer) state.layer.replaceChildren();
+                state.visibility.disconnect();
+                state.resizes.disconnect();
+                state.mutations.disconnect();
+                state.pinnedCount = 0;
+                state.overlayVersion = null;
+                // Untag page elements so Alt+Click stops resolving cleared ones
+                state.records.forEach(record => {
+                    const element = record.target.deref();
+                    if (element) element.removeAttribute('data-wi-id');
+                });
+                window.webInferenceState.overlays = new WeakMap();
+                window.webInferenceState.records.clear();
+                window.webInferenceState.stats = { elements: 0, cache: 0, new: 0 };
+            }
+        };
+        
+        window.__wi = api;
+        return api;
+    };
+})();
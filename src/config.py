@@ -2,9 +2,12 @@
 Configuration management for Web Inference
 """
 import os
+import re
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional, Literal
-from pydantic import BaseSettings, validator
+from pydantic import ValidationInfo, field_validator
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -47,9 +50,17 @@ class Settings(BaseSettings):
     log_level: str = "INFO"
     log_format: str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     
-    @validator("openai_api_key", "anthropic_api_key")
-    def validate_api_keys(cls, v, values):
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        env_file_encoding="utf-8",
+        extra="ignore"  # .env also carries keys read elsewhere (e.g. OLLAMA_URL)
+    )
+    
+    @field_validator("openai_api_key", "anthropic_api_key")
+    @classmethod
+    def validate_api_keys(cls, v, info: ValidationInfo):
         """Ensure appropriate API key is set based on provider"""
+        values = info.data
         provider = values.get("llm_provider")
         if provider == "openai" and not values.get("openai_api_key") and not v:
             raise ValueError("OpenAI API key required when using OpenAI provider")
@@ -57,20 +68,22 @@ class Settings(BaseSettings):
             raise ValueError("Anthropic API key required when using Anthropic provider")
         return v
     
-    @validator("data_dir")
+    @field_validator("data_dir")
+    @classmethod
     def create_data_dir(cls, v):
         """Ensure data directory exists"""
-        v.mkdir(parents=True, exist_ok=True)
-        (v / "site_knowledge").mkdir(exist_ok=True)
-        (v / "patterns").mkdir(exist_ok=True)
+        # Fast path: skip the mkdir syscalls once the tree is in place
+        if not (v / "site_knowledge").is_dir() or not (v / "patterns").is_dir():
+            v.mkdir(parents=True, exist_ok=True)
+            (v / "site_knowledge").mkdir(exist_ok=True)
+            (v / "patterns").mkdir(exist_ok=True)
         return v
-    
-    class Config:
-        env_file = ".env"
-        env_file_encoding = "utf-8"
 
-# Global settings instance
-settings = Settings()
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Build the settings once; later calls reuse the same instance"""
+    return Settings()
 
 # Confidence level thresholds
 CONFIDENCE_LEVELS = {
@@ -80,7 +93,7 @@ CONFIDENCE_LEVELS = {
 }
 
 # Element selectors to ignore
-IGNORED_SELECTORS = [
+IGNORED_SELECTORS = frozenset({
     "script",
     "style",
     "noscript",
@@ -88,7 +101,7 @@ IGNORED_SELECTORS = [
     "svg path",
     "br",
     "hr"
-]
+})
 
 # Semantic section patterns
 SECTION_PATTERNS = {
@@ -100,4 +113,32 @@ SECTION_PATTERNS = {
     "search": ["search", "find", "query"],
     "login": ["login", "signin", "auth"],
     "contact": ["contact", "email", "phone", "address"]
-}
\ No newline at end of file
+}
+
+
+def _pattern_alternation(patterns) -> str:
+    """Whole-word alternation; '-', '_' and spaces all count as separators"""
+    return r"(?<![a-z0-9])(?:" + "|".join(map(re.escape, patterns)) + r")(?![a-z0-9])"
+
+
+# Compiled once: one regex per section, plus a combined one whose named group
+# tells which section matched, so classifying text is a single search
+SECTION_REGEXES = {
+    name: re.compile(_pattern_alternation(patterns), re.IGNORECASE)
+    for name, patterns in SECTION_PATTERNS.items()
+}
+_ANY_SECTION_RE = re.compile(
+    "|".join(f"(?P<{name}>{_pattern_alternation(patterns)})"
+             for name, patterns in SECTION_PATTERNS.items()),
+    re.IGNORECASE
+)
+
+
+def classify_section(text: str) -> Optional[str]:
+    """Return the section named by the earliest pattern found in text
+    
+    Meant for tag names, ids and class strings, e.g. "site-header main-nav"
+    gives "header". Returns None when no section pattern occurs.
+    """
+    match = _ANY_SECTION_RE.search(text or "")
+    return match.lastgroup if match else None
@@ -3,14 +3,18 @@ Integrated Web Analyzer with Knowledge Persistence
 Combines browser control, knowledge store, and LLM analysis
 """
 import asyncio
+import hashlib
+import sys
+import threading
 from typing import Dict, List, Any, Optional
 from datetime import datetime
 from pathlib import Path
 import logging
 
-from playwright.async_api import async_playwright, Page, Browser
-from knowledge_store import KnowledgeStore, KnowledgeAwareAnalyzer
-from browser_with_controls import BrowserWithControls
+from playwright.async_api import async_playwright, Page, BrowserContext, Playwright
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from knowledge_store import KnowledgeStore, KnowledgeAwareAnalyzer, POSITION_BUCKET
+from browser_controller import BrowserWithControls
 
 logger = logging.getLogger(__name__)
 
@@ -18,43 +22,102 @@ logger = logging.getLogger(__name__)
 class IntegratedWebAnalyzer:
     """Main analyzer combining all components"""
     
-    def __init__(self, headless: bool = False):
+    # All potentially interesting elements, as one selector list so the
+    # browser matches them in a single traversal
+    ELEMENT_SELECTOR = ", ".join([
+        "header", "nav", "main", "section", "article", "aside",
+        "footer", "div[role]", "div[class*='content']",
+        "div[class*='section']", "div[id]:not([id=''])",
+        "form", "table"
+    ])
+    # The tool's own UI; its status text changes every run, so matching it
+    # would make every page look changed (and analyze our own panel)
+    TOOL_UI_SELECTOR = "#web-inference-controls, #wi-overlay-layer, .wi-modal, .wi-overlay"
+    
+    def __init__(self, headless: bool = False,
+                 profile_dir: Path = Path("data/chrome-profile")):
         self.headless = headless
-        self.browser: Optional[Browser] = None
+        self.profile_dir = profile_dir  # disk cache/cookies carried across sessions
+        self.playwright: Optional[Playwright] = None
+        self.context: Optional[BrowserContext] = None
         self.page: Optional[Page] = None
         self.controls: Optional[BrowserWithControls] = None
         self.knowledge_store = KnowledgeStore()
         self.knowledge_analyzer = KnowledgeAwareAnalyzer(self.knowledge_store)
         self.current_url = None
+        self._landed_url = None  # page.url right after the last navigation
+        self._llm_sem = asyncio.Semaphore(8)
+        self._snapshots: Dict[str, str] = {}  # url -> snapshot its overlays were last drawn from
         
     async def start(self):
-        """Start the browser and initialize components"""
-        playwright = await async_playwright().start()
-        self.browser = await playwright.chromium.launch(headless=self.headless)
-        self.page = await self.browser.new_page()
+        """Start the browser and initialize components (once per analyzer)"""
+        if self.page is not None:
+            return
+        
+        self.playwright = await async_playwright().start()
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        self.context = await self.playwright.chromium.launch_persistent_context(
+            user_data_dir=self.profile_dir,
+            headless=self.headless
+        )
+        # A persistent context opens with a blank tab already
+        self.page = self.context.pages[0] if self.context.pages else await self.context.new_page()
         self.controls = BrowserWithControls(self.page)
+        await self.controls.attach()
         
+        # Connect the analyze button to our method
+        self.controls.on_ui_event('analyze', self._on_analyze_request)
+
+    
+    async def _on_analyze_request(self):
+        """Re-run analysis when the page's Analyze button is pressed"""
+        # Ignore repeat clicks while a run is still in flight
+        if self.controls.is_analyzing:
+            return
+        self.controls.is_analyzing = True
+        try:
+            await self._run_analysis(force_fresh=True)
+        finally:
+            self.controls.is_analyzing = False
+        
+    async def close(self):
+        """Shut the browser down; the profile keeps its cache and cookies"""
+        if self.context:
+            await self.context.close()
+        if self.playwright:
+            await self.playwright.stop()
+        self.playwright = self.context = self.page = None
+    
     async def analyze_url(self, url: str, force_fresh: bool = False):
-        """Navigate to URL and run analysis"""
+        """Navigate to URL and run analysis, reusing the running browser"""
+        await self.start()
+        
+        # Asking again for the page that's still open keeps the document,
+        # and with it any overlays already drawn for it
+        reentry = (not force_fresh and url == self.current_url
+                   and self.page.url == self._landed_url)
         self.current_url = url
         
-        # Navigate to the page
-        await self.page.goto(url, wait_until="networkidle")
+        if not reentry:
+            # Navigate to the page; analysis only needs the DOM, so give the
+            # network a short grace period rather than waiting out every beacon
+            await self.page.goto(url, wait_until="domcontentloaded")
+            try:
+                await self.page.wait_for_load_state("networkidle", timeout=1500)
+            except PlaywrightTimeoutError:
+                pass
+            self._landed_url = self.page.url
         
         # Check if we have cached knowledge
-        existing_knowledge = self.knowledge_store.load_site_knowledge(url)
+        # (the first load for a site parses its log, so keep it off the loop)
+        existing_knowledge = await asyncio.get_running_loop().run_in_executor(
+            None, self.knowledge_store.load_site_knowledge, url
+        )
         has_cache = len(existing_knowledge) > 0
         
         # Inject control overlay
         await self.controls.inject_control_overlay(has_cached_knowledge=has_cache)
         
-        # Connect the analyze button to our method
-        await self.page.expose_function('requestAnalysis', 
-                                       lambda: asyncio.create_task(self._run_analysis(force_fresh=True)))
-        await self.page.evaluate("""
-            window.addEventListener('web-inference-analyze', () => window.requestAnalysis());
-        """)
-        
         if not has_cache or force_fresh:
             # Run initial analysis
             await self._run_analysis(force_fresh=force_fresh)
@@ -64,47 +127,82 @@ class IntegratedWebAnalyzer:
     
     async def _run_analysis(self, force_fresh: bool = False):
         """Run the actual analysis"""
-        await self.controls.update_status("Analyzing...", "#ff9800")
+        # Show progress, extract elements and read which run the page's
+        # overlays came from; the calls are independent, so let Playwright
+        # pipeline them
+        _, elements, drawn_version = await asyncio.gather(
+            self.controls.update_status("Analyzing...", "#ff9800"),
+            self._extract_page_elements(),
+            self.controls.overlay_version()
+        )
         
-        # Clear existing overlays
-        await self.controls.clear_overlays()
+        # Nothing to redo if the page looks exactly like it did when its
+        # current overlays were drawn. The version lives in the page, so a
+        # navigation or the Clear button invalidates it on its own
+        snapshot = self._snapshot_hash(elements)
+        if not force_fresh and snapshot == drawn_version:
+            await self.controls.update_status("Unchanged since last analysis", "#4CAF50")
+            return
         
-        # Extract elements hierarchically
-        elements = await self._extract_page_elements()
+        await self.controls.clear_overlays()
         
         # Reset stats
-        self.knowledge_analyzer.stats = {'cache_hits': 0, 'llm_calls': 0}
+        self.knowledge_analyzer.stats = {'cache_hits': 0, 'near_hits': 0, 'llm_calls': 0}
         
-        # Analyze each element
-        analyzed_count = 0
-        for element_data in elements:
-            try:
-                # Get analysis (from cache or fresh)
-                analysis = await self.knowledge_analyzer.analyze_with_cache(
+        # Analyze elements concurrently; the semaphore bounds in-flight LLM
+        # calls so a large page can't flood the provider
+        async def process(element_data):
+            async with self._llm_sem:
+                analysis, from_cache = await self.knowledge_analyzer.analyze_with_cache(
                     self.current_url, 
                     element_data,
                     force_fresh=force_fresh
                 )
-                
-                # Create overlay
-                from_cache = self.knowledge_analyzer.stats['cache_hits'] > analyzed_count
-                await self.controls.create_element_overlay(
-                    element_data['element'],
-                    analysis,
-                    from_cache=from_cache
-                )
-                
-                analyzed_count += 1
-                
-                # Update stats periodically
-                if analyzed_count % 5 == 0:
+            return element_data['element'], analysis, from_cache
+        
+        # Overlays are collected and drawn together at the end, so the page
+        # does one read pass and one write pass instead of one per element
+        overlays = []
+        analyzed_count = 0
+        
+        # Progress goes to the page from a background task at most every
+        # 250ms, so stats round trips never hold up the analysis loop
+        progress = {'elements': 0, 'dirty': False}
+        
+        async def push_stats():
+            while True:
+                await asyncio.sleep(0.25)
+                if progress['dirty']:
+                    progress['dirty'] = False
                     await self.controls.update_stats({
-                        'elements': analyzed_count,
+                        'elements': progress['elements'],
                         **self.knowledge_analyzer.stats
                     })
-                
-            except Exception as e:
-                logger.error(f"Error analyzing element: {e}")
+        
+        stats_task = asyncio.create_task(push_stats())
+        try:
+            for finished in asyncio.as_completed([process(e) for e in elements]):
+                try:
+                    overlays.append(await finished)
+                    analyzed_count += 1
+                    progress.update(elements=analyzed_count, dirty=True)
+                    
+                except Exception as e:
+                    logger.error(f"Error analyzing element: {e}")
+        finally:
+            stats_task.cancel()
+        
+        # Persist everything learned in this run with a single write, in a
+        # worker thread so the page controls stay responsive meanwhile. A
+        # failed write keeps the entries dirty for the next flush and must
+        # not cost the user the overlays they just waited for
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.knowledge_store.flush_all)
+        except OSError as e:
+            logger.error(f"Error saving site knowledge: {e}")
+        
+        await self.controls.create_element_overlays(overlays, version=snapshot)
+        self._snapshots[self.current_url] = snapshot
         
         # Final status update
         cache_percent = (self.knowledge_analyzer.stats['cache_hits'] / max(analyzed_count, 1)) * 100
@@ -112,22 +210,32 @@ class IntegratedWebAnalyzer:
         if not force_fresh and cache_percent > 0:
             status_text += f" ({cache_percent:.0f}% from cache)"
         
-        await self.controls.update_status(status_text, "#4CAF50")
-        await self.controls.update_stats({
-            'elements': analyzed_count,
-            **self.knowledge_analyzer.stats
-        })
+        await asyncio.gather(
+            self.controls.update_status(status_text, "#4CAF50"),
+            self.controls.update_stats({
+                'elements': analyzed_count,
+                **self.knowledge_analyzer.stats
+            })
+        )
         
         logger.info(f"Analysis complete: {analyzed_count} elements analyzed")
     
     async def _load_cached_analysis(self):
         """Load and display cached analysis"""
+        # Overlays drawn for this URL earlier in this document are still
+        # current; skip the extraction and redraw
+        known = self._snapshots.get(self.current_url)
+        if known and await self.controls.overlay_version() == known:
+            await self.controls.update_status("Cached analysis already shown", "#4CAF50")
+            return
+        
         await self.controls.update_status("Loading cached analysis...", "#2196F3")
         
         # Extract current page elements
         elements = await self._extract_page_elements()
+        snapshot = self._snapshot_hash(elements)
         
-        loaded_count = 0
+        overlays = []
         for element_data in elements:
             # Check cache
             knowledge = self.knowledge_store.find_element_knowledge(
@@ -136,81 +244,163 @@ class IntegratedWebAnalyzer:
             )
             
             if knowledge:
-                # Create overlay from cached knowledge
-                await self.controls.create_element_overlay(
-                    element_data['element'],
-                    knowledge.llm_response,
-                    from_cache=True
-                )
-                loaded_count += 1
+                overlays.append((element_data['element'], knowledge.llm_response, True))
         
-        await self.controls.update_status(
-            f"Loaded {loaded_count} cached analyses", 
-            "#4CAF50"
-        )
+        # Create all overlays from cached knowledge in one call
+        await self.controls.create_element_overlays(overlays, version=snapshot)
+        self._snapshots[self.current_url] = snapshot
+        loaded_count = len(overlays)
         
-        # Show stats
-        await self.controls.update_stats({
-            'elements': loaded_count,
-            'cache_hits': loaded_count,
-            'llm_calls': 0
-        })
+        # Show status and stats
+        await asyncio.gather(
+            self.controls.update_status(
+                f"Loaded {loaded_count} cached analyses", 
+                "#4CAF50"
+            ),
+            self.controls.update_stats({
+                'elements': loaded_count,
+                'cache_hits': loaded_count,
+                'llm_calls': 0
+            })
+        )
+    
+    @staticmethod
+    def _snapshot_hash(elements: List[Dict[str, Any]]) -> str:
+        """Hash the extracted element descriptors (not their handles)"""
+        snapshot = repr([
+            (e['tagName'], e['id'], e['className'], e['text'], tuple(e['rect'].values()))
+            for e in elements
+        ])
+        return hashlib.blake2b(snapshot.encode(), digest_size=16).hexdigest()
     
     async def _extract_page_elements(self) -> List[Dict[str, Any]]:
         """Extract analyzable elements from the page"""
-        # Get all potentially interesting elements
-        selectors = [
-            "header", "nav", "main", "section", "article", "aside",
-            "footer", "div[role]", "div[class*='content']",
-            "div[class*='section']", "div[id]:not([id=''])",
-            "form", "table"
-        ]
+        # One round trip for the whole scan: matching, de-duplication and the
+        # visibility check all happen in the page, and only survivors cross
+        # back. Their handles come back together via get_properties().
+        # The joined selector walks the document once, in document order, so
+        # ancestors are always seen before their descendants. A node is
+        # skipped if it nearly fills the box of its nearest kept ancestor
+        # (a wrapper and its content describe the same region, while a
+        # page-wide #root or #app must not hide the sections inside it), or
+        # if an earlier node has the same tag/id/class/text/position
+        # signature the knowledge store hashes on (it would share that cache
+        # entry anyway).
+        found = await self.page.evaluate_handle("""
+            ({ selector, exclude, limit, bucket }) => {
+                const kept = new WeakMap();  // kept element -> its box area
+                const signatures = new Map();
+                const elements = [];
+                const descriptors = [];
+                const fillsKeptAncestor = (el, area) => {
+                    for (let node = el.parentElement; node; node = node.parentElement) {
+                        if (kept.has(node)) return area >= 0.9 * kept.get(node);
+                    }
+                    return false;
+                };
+                for (const el of document.querySelectorAll(selector)) {
+                    if (el.closest(exclude)) continue;
+                    // The size check alone settles visibility: display:none
+                    // boxes measure 0x0, so no computed-style read is needed
+                    const rect = el.getBoundingClientRect();
+                    if (rect.width <= 50 || rect.height <= 50) continue;
+                    const area = rect.width * rect.height;
+                    if (fillsKeptAncestor(el, area)) continue;
+                    const tagName = el.tagName.toLowerCase();
+                    const id = el.id || '';
+                    const className = el.className || '';
+                    // innerText skips <script>/<style> bodies and hidden text
+                    // (collapsed menus, screen-reader labels) that textContent
+                    // would put in the prompt. The rect read above already
+                    // brought layout up to date, so it forces no extra reflow
+                    const text = (el.innerText || '')
+                        .substring(0, 1000)
+                        .replace(/\\s+/g, ' ')
+                        .trim()
+                        .substring(0, 200);
+                    // Mirrors KnowledgeStore._compute_element_hash: collapsed
+                    // text and positions in POSITION_BUCKET-pixel buckets
+                    const signature = [
+                        tagName, id, className, text.substring(0, 100),
+                        Math.floor(Math.trunc(rect.x) / bucket),
+                        Math.floor(Math.trunc(rect.y) / bucket)
+                    ].join('|');
+                    if (signatures.has(signature)) continue;
+                    signatures.set(signature, el);
+                    kept.set(el, area);
+                    elements.push(el);
+                    descriptors.push({
+                        tagName,
+                        id,
+                        className,
+                        text,
+                        rect: {
+                            x: rect.x,
+                            y: rect.y,
+                            width: rect.width,
+                            height: rect.height
+                        },
+                        visible: true
+                    });
+                    if (elements.length >= limit) break;
+                }
+                return { elements, descriptors };
+            }
+        """, {
+            "selector": self.ELEMENT_SELECTOR,
+            "exclude": self.TOOL_UI_SELECTOR,
+            "limit": 30,  # Limit to 30 elements for demo
+            "bucket": POSITION_BUCKET
+        })
+        
+        try:
+            descriptors = await found.evaluate("found => found.descriptors")
+            listing = await found.get_property("elements")
+            handles = await listing.get_properties()
+            await listing.dispose()
+        finally:
+            await found.dispose()
         
         elements = []
-        for selector in selectors:
-            found = await self.page.query_selector_all(selector)
-            for element in found:
-                try:
-                    # Get element data
-                    data = await element.evaluate("""
-                        (el) => {
-                            const rect = el.getBoundingClientRect();
-                            return {
-                                tagName: el.tagName.toLowerCase(),
-                                id: el.id || '',
-                                className: el.className || '',
-                                text: el.innerText?.substring(0, 200) || '',
-                                rect: {
-                                    x: rect.x,
-                                    y: rect.y,
-                                    width: rect.width,
-                                    height: rect.height
-                                },
-                                visible: rect.width > 50 && rect.height > 50 &&
-                                        window.getComputedStyle(el).display !== 'none'
-                            };
-                        }
-                    """)
-                    
-                    if data['visible']:
-                        data['element'] = element
-                        elements.append(data)
-                        
-                except Exception as e:
-                    logger.error(f"Error extracting element: {e}")
+        for index, data in enumerate(descriptors):
+            element = handles[str(index)].as_element()
+            if element is None:
+                logger.error(f"Error extracting element: lost handle #{index}")
+                continue
+            data['element'] = element
+            elements.append(data)
         
-        # Remove duplicates and nested elements
-        # (simplified for now - you could make this more sophisticated)
-        return elements[:30]  # Limit to 30 elements for demo
+        return elements
     
     async def clear_site_knowledge(self):
         """Clear all knowledge for current site"""
         if self.current_url:
             self.knowledge_store.clear_site_knowledge(self.current_url)
+            self.knowledge_analyzer.forget_site(self.current_url)
             await self.controls.update_status("Knowledge cleared", "#f44336")
             logger.info(f"Cleared knowledge for {self.current_url}")
 
 
+def _stdin_lines(loop: asyncio.AbstractEventLoop) -> "asyncio.Queue[Optional[str]]":
+    """Feed stdin lines into a queue from a daemon thread (None at EOF)
+    
+    Unlike asyncio.to_thread(input), a blocked daemon thread neither keeps
+    the process alive nor holds up asyncio.run's shutdown after Ctrl+C.
+    """
+    lines: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+    
+    def read():
+        try:
+            for line in sys.stdin:
+                loop.call_soon_threadsafe(lines.put_nowait, line)
+            loop.call_soon_threadsafe(lines.put_nowait, None)
+        except RuntimeError:
+            pass  # The loop closed while we were waiting for input
+    
+    threading.Thread(target=read, name="stdin-reader", daemon=True).start()
+    return lines
+
+
 # Example usage
 async def main():
     """Example usage of the integrated analyzer"""
@@ -224,8 +414,11 @@ async def main():
     try:
         await analyzer.start()
         
-        # Get URL from user
-        url = input("Enter URL to analyze (default: https://example.com): ").strip()
+        # Get URL from user; stdin is read off the loop so the page
+        # controls stay responsive while we wait
+        lines = _stdin_lines(asyncio.get_running_loop())
+        print("Enter URL to analyze (default: https://example.com): ", end="", flush=True)
+        url = ((await lines.get()) or "").strip()
         if not url:
             url = "https://example.com"
         
@@ -239,247 +432,26 @@ async def main():
         
         await analyzer.analyze_url(url)
         
-        # Keep running
-        print("\nPress Ctrl+C to exit...")
+        # Keep running, reusing the same browser for any further URLs
+        print("\nEnter another URL to analyze, or press Ctrl+C to exit...")
         while True:
-            await asyncio.sleep(1)
+            print("> ", end="", flush=True)
+            line = await lines.get()
+            if line is None:
+                break  # stdin closed
+            url = line.strip()
+            if url:
+                await analyzer.analyze_url(url)
             
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        # asyncio.run delivers Ctrl+C by cancelling this task
         print("\n\nClosing browser...")
     finally:
-        if analyzer.browser:
-            await analyzer.browser.close()
-
-
-async def _extract_page_elements(self) -> List[Dict[str, Any]]:
-    """Extract analyzable elements from the page with click detection"""
-    # Get all potentially interesting elements
-    selectors = [
-        "header", "nav", "main", "section", "article", "aside",
-        "footer", "div[role]", "div[class*='content']",
-        "div[class*='section']", "div[id]:not([id=''])",
-        "form", "table", "a", "button", "input[type='submit']"  # Added clickable elements
-    ]
-    
-    elements = []
-    for selector in selectors:
-        found = await self.page.query_selector_all(selector)
-        for element in found:
-            try:
-                # Get element data including clickability
-                data = await element.evaluate("""
-                    (el) => {
-                        const rect = el.getBoundingClientRect();
-                        const isClickable = (
-                            el.tagName === 'A' || 
-                            el.tagName === 'BUTTON' ||
-                            el.onclick !== null ||
-                            el.getAttribute('role') === 'button' ||
-                            window.getComputedStyle(el).cursor === 'pointer'
-                        );
-                        
-                        // Get children info for context
-                        const children = Array.from(el.children).slice(0, 5).map(child => ({
-                            tag: child.tagName.toLowerCase(),
-                            text: child.innerText?.substring(0, 30) || ''
-                        }));
-                        
-                        return {
-                            tagName: el.tagName.toLowerCase(),
-                            id: el.id || '',
-                            className: el.className || '',
-                            text: el.innerText?.substring(0, 200) || '',
-                            rect: {
-                                x: rect.x,
-                                y: rect.y,
-                                width: rect.width,
-                                height: rect.height
-                            },
-                            visible: rect.width > 50 && rect.height > 50 &&
-                                    window.getComputedStyle(el).display !== 'none',
-                            clickable: isClickable,
-                            href: el.href || '',
-                            children: children
-                        };
-                    }
-                """)
-                
-                if data['visible']:
-                    data['element'] = element
-                    elements.append(data)
-                    
-            except Exception as e:
-                logger.error(f"Error extracting element: {e}")
-    
-    # Remove duplicates and nested elements
-    return elements[:30]  # Limit to 30 elements for demo
+        await analyzer.close()
 
 
-# Updated overlay creation with better interaction
-async def create_element_overlay_interactive(self, element: ElementHandle, 
-                                           analysis: Dict[str, Any], 
-                                           from_cache: bool = False):
-    """Create overlay that allows click-through for interactive elements"""
-    
-    color = self._get_confidence_color(analysis.get('confidence', 0))
-    cache_indicator = "📦" if from_cache else "✨"
-    
-    await element.evaluate(f"""
-        (element) => {{
-            const rect = element.getBoundingClientRect();
-            const isClickable = element.tagName === 'A' || 
-                               element.tagName === 'BUTTON' ||
-                               element.onclick !== null;
-            
-            // Create overlay
-            const overlay = document.createElement('div');
-            overlay.className = 'wi-overlay';
-            overlay.style.cssText = `
-                position: fixed;
-                left: ${{rect.left}}px;
-                top: ${{rect.top}}px;
-                width: ${{rect.width}}px;
-                height: ${{rect.height}}px;
-                border: 2px solid {color};
-                background: transparent;
-                pointer-events: ${{isClickable ? 'none' : 'auto'}}; /* Allow clicks through for clickable elements */
-                z-index: 9998;
-                transition: all 0.3s ease;
-            `;
-            
-            // Info badge
-            const badge = document.createElement('div');
-            badge.style.cssText = `
-                position: absolute;
-                top: -25px;
-                right: 0;
-                background: rgba(0, 0, 0, 0.8);
-                color: white;
-                padding: 4px 8px;
-                border-radius: 4px;
-                font-size: 11px;
-                font-family: system-ui;
-                pointer-events: auto;
-                cursor: help;
-            `;
-            badge.innerHTML = `{cache_indicator} Alt+Click for info`;
-            overlay.appendChild(badge);
-            
-            // Click behavior indicator for clickable elements
-            if ({json.dumps(analysis.get('click_behavior', ''))}) {{
-                const clickInfo = document.createElement('div');
-                clickInfo.style.cssText = `
-                    position: absolute;
-                    bottom: -20px;
-                    left: 0;
-                    background: rgba(33, 150, 243, 0.9);
-                    color: white;
-                    padding: 2px 6px;
-                    border-radius: 3px;
-                    font-size: 10px;
-                    font-family: system-ui;
-                    max-width: 200px;
-                    white-space: nowrap;
-                    overflow: hidden;
-                    text-overflow: ellipsis;
-                `;
-                clickInfo.textContent = '→ ' + {json.dumps(analysis.get('click_behavior', 'Click action'))};
-                overlay.appendChild(clickInfo);
-            }}
-            
-            document.body.appendChild(overlay);
-            
-            // Store reference
-            window.webInferenceState.overlays.set(element, {{
-                overlay: overlay,
-                analysis: {json.dumps(analysis)}
-            }});
-            
-            // Show full info on Alt+Click
-            const showInfo = (e) => {{
-                if (e.altKey) {{
-                    e.preventDefault();
-                    e.stopPropagation();
-                    
-                    // Create modal with full analysis
-                    const modal = document.createElement('div');
-                    modal.style.cssText = `
-                        position: fixed;
-                        top: 50%;
-                        left: 50%;
-                        transform: translate(-50%, -50%);
-                        background: rgba(0, 0, 0, 0.95);
-                        color: white;
-                        padding: 30px;
-                        border-radius: 10px;
-                        z-index: 10001;
-                        max-width: 600px;
-                        font-family: system-ui;
-                        line-height: 1.6;
-                    `;
-                    
-                    const analysis = window.webInferenceState.overlays.get(element).analysis;
-                    modal.innerHTML = `
-                        <h3 style="margin: 0 0 20px 0; color: #4fc3f7;">
-                            AI Analysis {cache_indicator}
-                        </h3>
-                        <div style="margin-bottom: 15px;">
-                            <strong style="color: #81c784;">Understanding:</strong><br>
-                            ${{analysis.understanding}}
-                        </div>
-                        <div style="margin-bottom: 15px;">
-                            <strong style="color: #81c784;">Purpose:</strong><br>
-                            ${{analysis.purpose}}
-                        </div>
-                        <div style="margin-bottom: 15px;">
-                            <strong style="color: #81c784;">User Intent:</strong><br>
-                            ${{analysis.user_intent || 'Not specified'}}
-                        </div>
-                        ${{analysis.click_behavior ? `
-                        <div style="margin-bottom: 15px;">
-                            <strong style="color: #64b5f6;">Click Behavior:</strong><br>
-                            ${{analysis.click_behavior}}
-                        </div>
-                        ` : ''}}
-                        <div style="margin-bottom: 15px;">
-                            <strong style="color: #81c784;">Confidence:</strong> 
-                            ${{(analysis.confidence * 100).toFixed(0)}}%
-                        </div>
-                        <div style="margin-bottom: 15px;">
-                            <strong style="color: #81c784;">Key Features:</strong><br>
-                            ${{(analysis.key_elements || []).join(', ')}}
-                        </div>
-                        <button onclick="this.parentElement.remove()" 
-                                style="background: #4fc3f7; border: none; 
-                                       padding: 10px 20px; border-radius: 5px; 
-                                       cursor: pointer; margin-top: 10px;
-                                       font-weight: 500;">
-                            Close
-                        </button>
-                    `;
-                    
-                    document.body.appendChild(modal);
-                    modal.addEventListener('click', (e) => {{
-                        if (e.target === modal) modal.remove();
-                    }});
-                }}
-            }};
-            
-            // Add listeners to both overlay and element
-            overlay.addEventListener('click', showInfo);
-            element.addEventListener('click', showInfo);
-            
-            // Update position on scroll/resize
-            const updatePosition = () => {{
-                const newRect = element.getBoundingClientRect();
-                overlay.style.left = newRect.left + 'px';
-                overlay.style.top = newRect.top + 'px';
-            }};
-            
-            window.addEventListener('scroll', updatePosition);
-            window.addEventListener('resize', updatePosition);
-        }}
-    """, element)
-
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass  # Already handled inside main()
\ No newline at end of file
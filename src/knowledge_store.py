@@ -4,14 +4,47 @@ Simple JSON-based storage for quick prototyping
 """
 import json
 import hashlib
+import threading
 from pathlib import Path
 from datetime import datetime
-from typing import Dict, List, Optional, Any
-from dataclasses import dataclass, asdict
+from typing import Dict, List, Optional, Any, Tuple
+from dataclasses import dataclass
+from collections import OrderedDict
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Runtime data lives at the project root, wherever the process is started
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+# Elements whose text SimHashes differ in at most this many bits are
+# treated as the same element for cache purposes
+SIMHASH_MAX_DISTANCE = 3
+# Positions are hashed in buckets of this many pixels so small layout
+# shifts don't invalidate the cache
+POSITION_BUCKET = 32
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over character 4-grams of whitespace/case-normalized text"""
+    text = ' '.join(text.lower().split())
+    if not text:
+        return 0
+    
+    weights = [0] * 64
+    for i in range(max(len(text) - 3, 1)):
+        shingle = text[i:i + 4].encode()
+        value = int.from_bytes(hashlib.blake2b(shingle, digest_size=8).digest(), 'big')
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit, weight in enumerate(weights) if weight > 0)
+
+
+def _similarity_bucket(element_data: Dict[str, Any]) -> str:
+    """Group elements that can only be near-duplicates of each other"""
+    classes = (element_data.get('className') or '').split()[:3]
+    return f"{element_data.get('tagName')}|{' '.join(sorted(set(classes)))}"
+
 
 @dataclass
 class ElementKnowledge:
@@ -24,59 +57,111 @@ class ElementKnowledge:
     confidence: float
     timestamp: str
     llm_response: Dict[str, Any]
+    bucket: str = ''  # Tag + class set, for near-duplicate lookups
+    text_simhash: int = 0  # SimHash of the element text (0 if no text)
+    
+    def to_json(self) -> str:
+        """Serialize as one log line"""
+        # The instance dict already has the record's shape, so encode it
+        # directly rather than deep-copying it through asdict()
+        return json.dumps(vars(self))
     
 
 class KnowledgeStore:
     """Simple file-based knowledge persistence"""
     
-    def __init__(self, data_dir: Path = Path("data/site_knowledge")):
+    def __init__(self, data_dir: Path = DATA_DIR / "site_knowledge"):
         self.data_dir = data_dir
         self.data_dir.mkdir(parents=True, exist_ok=True)
-        self.cache = {}  # In-memory cache
+        self.cache = {}  # In-memory cache: url -> {element_hash: ElementKnowledge}
+        self._dirty = {}  # url -> {element_hash: ElementKnowledge} not yet appended to the log
+        # Flushes run in worker threads while the event loop keeps upserting;
+        # this guards every read-modify-write of _dirty
+        self._dirty_lock = threading.Lock()
+        self._log_lines = {}  # url -> lines currently in the site's log file
+        self._similar = {}  # url -> {bucket: [(text_simhash, element_hash)]}
+        self._mtimes = {}  # url -> st_mtime_ns of the log when cache was last synced
         
     def _get_site_file(self, url: str) -> Path:
-        """Get the JSON file for a specific site"""
+        """Get the JSONL log file for a specific site"""
         # Create safe filename from URL
-        safe_name = hashlib.md5(url.encode()).hexdigest()[:12]
+        safe_name = hashlib.blake2b(url.encode(), digest_size=6).hexdigest()
         domain = url.split('/')[2].replace('www.', '')
-        return self.data_dir / f"{domain}_{safe_name}.json"
+        return self.data_dir / f"{domain}_{safe_name}.jsonl"
     
     def _compute_element_hash(self, element_data: Dict[str, Any]) -> str:
         """Create hash of element properties for comparison"""
-        # Hash based on stable properties
-        key_props = {
-            'tag': element_data.get('tagName'),
-            'id': element_data.get('id'),
-            'classes': element_data.get('className'),
-            'text_preview': element_data.get('text', '')[:100],
-            'position': f"{element_data.get('rect', {}).get('x', 0)},{element_data.get('rect', {}).get('y', 0)}"
-        }
-        return hashlib.md5(json.dumps(key_props, sort_keys=True).encode()).hexdigest()[:16]
+        # Hash based on stable properties, as a canonical tuple
+        rect = element_data.get('rect') or {}
+        key_props = (
+            element_data.get('tagName'),
+            element_data.get('id'),
+            element_data.get('className'),
+            ' '.join((element_data.get('text') or '').split())[:100],
+            int(rect.get('x', 0)) // POSITION_BUCKET,
+            int(rect.get('y', 0)) // POSITION_BUCKET,
+        )
+        return hashlib.blake2b(repr(key_props).encode(), digest_size=8).hexdigest()
+    
+    @staticmethod
+    def _file_mtime(site_file: Path) -> Optional[int]:
+        """Modification time of a log file, or None if it doesn't exist"""
+        try:
+            return site_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
     
     def load_site_knowledge(self, url: str) -> Dict[str, ElementKnowledge]:
-        """Load all knowledge for a site"""
+        """Load all knowledge for a site, re-reading the log only if it changed"""
         site_file = self._get_site_file(url)
+        mtime = self._file_mtime(site_file)
         
-        if site_file.exists():
+        # Unsaved entries make memory the newer copy; otherwise the cache is
+        # good for as long as nobody else has touched the file
+        if url in self.cache and (url in self._dirty or mtime == self._mtimes.get(url)):
+            return self.cache[url]
+        
+        knowledge = {}
+        lines = 0
+        
+        if mtime is not None:
             try:
                 with open(site_file, 'r') as f:
-                    data = json.load(f)
-                    # Convert back to ElementKnowledge objects
-                    knowledge = {}
-                    for key, value in data.items():
-                        knowledge[key] = ElementKnowledge(**value)
+                    # One record per line; later records for the same
+                    # element replace earlier ones
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        value = json.loads(line)
+                        knowledge[value['element_hash']] = ElementKnowledge(**value)
+                        lines += 1
                     logger.info(f"Loaded {len(knowledge)} elements for {url}")
-                    return knowledge
             except Exception as e:
                 logger.error(f"Error loading knowledge: {e}")
+                knowledge = {}
+                lines = 0
         
-        return {}
+        self.cache[url] = knowledge
+        self._log_lines[url] = lines
+        self._mtimes[url] = mtime
+        self._similar[url] = {}
+        for entry in knowledge.values():
+            self._index_similar(url, entry)
+        return knowledge
+    
+    def _index_similar(self, url: str, knowledge: ElementKnowledge):
+        """Make an element findable by near-duplicate lookups"""
+        if knowledge.bucket and knowledge.text_simhash:
+            self._similar[url].setdefault(knowledge.bucket, []).append(
+                (knowledge.text_simhash, knowledge.element_hash)
+            )
     
     def save_element_knowledge(self, url: str, element_data: Dict[str, Any], 
-                              llm_response: Dict[str, Any]) -> ElementKnowledge:
-        """Save knowledge about an element"""
+                              llm_response: Dict[str, Any],
+                              element_hash: Optional[str] = None) -> ElementKnowledge:
+        """Save knowledge about an element (element_hash skips recomputing it)"""
         # Create element knowledge
-        element_hash = self._compute_element_hash(element_data)
+        element_hash = element_hash or self._compute_element_hash(element_data)
         selector = self._build_selector(element_data)
         
         knowledge = ElementKnowledge(
@@ -87,30 +172,107 @@ class KnowledgeStore:
             purpose=llm_response.get('purpose', ''),
             confidence=llm_response.get('confidence', 0.0),
             timestamp=datetime.now().isoformat(),
-            llm_response=llm_response
+            llm_response=llm_response,
+            bucket=_similarity_bucket(element_data),
+            text_simhash=simhash(element_data.get('text') or '')
         )
         
-        # Load existing knowledge
+        self.upsert(url, knowledge)
+        
+        logger.info(f"Saved knowledge for element {selector} on {url}")
+        return knowledge
+    
+    def upsert(self, url: str, knowledge: ElementKnowledge):
+        """Add/update an element in memory; written to disk by flush_site()"""
+        # Saves normally follow a lookup, so the site is already in memory
+        site_knowledge = self.cache.get(url)
+        if site_knowledge is None:
+            site_knowledge = self.load_site_knowledge(url)
+        if knowledge.element_hash not in site_knowledge:
+            self._index_similar(url, knowledge)
+        site_knowledge[knowledge.element_hash] = knowledge
+        with self._dirty_lock:
+            self._dirty.setdefault(url, {})[knowledge.element_hash] = knowledge
+    
+    def find_element_knowledge(self, url: str, element_data: Dict[str, Any],
+                               element_hash: Optional[str] = None) -> Optional[ElementKnowledge]:
+        """Find existing knowledge for an element, or for a near-duplicate of it"""
+        element_hash = element_hash or self._compute_element_hash(element_data)
         site_knowledge = self.load_site_knowledge(url)
+        existing = site_knowledge.get(element_hash)
+        if existing:
+            return existing
         
-        # Add/update this element
-        site_knowledge[element_hash] = knowledge
+        # Same tag and classes with nearly the same text
+        candidates = self._similar[url].get(_similarity_bucket(element_data))
+        if candidates:
+            text_simhash = simhash(element_data.get('text') or '')
+            if text_simhash:
+                for other_simhash, other_hash in candidates:
+                    if bin(text_simhash ^ other_simhash).count('1') <= SIMHASH_MAX_DISTANCE:
+                        return site_knowledge[other_hash]
+        return None
+    
+    def flush_site(self, url: str):
+        """Append pending knowledge for a site to its log"""
+        with self._dirty_lock:
+            pending = dict(self._dirty.get(url, {}))
+        if not pending:
+            return
         
-        # Save back to file
+        # The URL stays dirty until the write is done, so a concurrent load
+        # keeps serving memory instead of re-reading a half-written log
+        site_knowledge = self.cache[url]
         site_file = self._get_site_file(url)
-        with open(site_file, 'w') as f:
-            # Convert to dict for JSON serialization
-            data = {k: asdict(v) for k, v in site_knowledge.items()}
-            json.dump(data, f, indent=2)
+        with open(site_file, 'a') as f:
+            for knowledge in pending.values():
+                f.write(knowledge.to_json() + '\n')
+        self._mtimes[url] = self._file_mtime(site_file)
+        self._log_lines[url] = self._log_lines.get(url, 0) + len(pending)
+        self._mark_clean(url, pending)
+        logger.info(f"Flushed {len(pending)} elements for {url}")
         
-        logger.info(f"Saved knowledge for element {selector} on {url}")
-        return knowledge
+        # Superseded records pile up as elements get re-analyzed
+        if self._log_lines[url] > 2 * len(site_knowledge):
+            self.compact_site(url)
     
-    def find_element_knowledge(self, url: str, element_data: Dict[str, Any]) -> Optional[ElementKnowledge]:
-        """Find existing knowledge for an element"""
-        element_hash = self._compute_element_hash(element_data)
-        site_knowledge = self.load_site_knowledge(url)
-        return site_knowledge.get(element_hash)
+    def flush_all(self):
+        """Append pending knowledge for every site with unsaved changes"""
+        for url in list(self._dirty):
+            self.flush_site(url)
+    
+    def compact_site(self, url: str):
+        """Rewrite a site's log with only the live record for each element"""
+        # Snapshot first: this may run in a worker thread while analysis
+        # keeps adding entries on the event loop
+        snapshot = list(self.load_site_knowledge(url).values())
+        site_file = self._get_site_file(url)
+        tmp_file = site_file.with_suffix('.tmp')
+        with open(tmp_file, 'w') as f:
+            for knowledge in snapshot:
+                f.write(knowledge.to_json() + '\n')
+        tmp_file.replace(site_file)
+        
+        self._mtimes[url] = self._file_mtime(site_file)
+        self._log_lines[url] = len(snapshot)
+        self._mark_clean(url, {knowledge.element_hash: knowledge for knowledge in snapshot})
+        logger.info(f"Compacted knowledge log for {url}")
+    
+    def _mark_clean(self, url: str, written: Dict[str, ElementKnowledge]):
+        """Forget pending entries that have now been written
+        
+        Entries are matched by identity, so one re-saved after the write
+        began stays pending with its newer value.
+        """
+        with self._dirty_lock:
+            pending = self._dirty.get(url)
+            if pending is None:
+                return
+            for element_hash, knowledge in written.items():
+                if pending.get(element_hash) is knowledge:
+                    del pending[element_hash]
+            if not pending:
+                del self._dirty[url]
     
     def _build_selector(self, element_data: Dict[str, Any]) -> str:
         """Build a CSS selector for the element"""
@@ -128,6 +290,12 @@ class KnowledgeStore:
     
     def clear_site_knowledge(self, url: str):
         """Clear all knowledge for a site (for re-analysis)"""
+        self.cache.pop(url, None)
+        with self._dirty_lock:
+            self._dirty.pop(url, None)
+        self._log_lines.pop(url, None)
+        self._similar.pop(url, None)
+        self._mtimes.pop(url, None)
         site_file = self._get_site_file(url)
         if site_file.exists():
             site_file.unlink()
@@ -137,24 +305,54 @@ class KnowledgeStore:
 class KnowledgeAwareAnalyzer:
     """Analyzer that uses persisted knowledge"""
     
-    def __init__(self, knowledge_store: KnowledgeStore):
+    def __init__(self, knowledge_store: KnowledgeStore, memory_size: int = 4096):
         self.store = knowledge_store
         self.stats = {
             'cache_hits': 0,
+            'near_hits': 0,  # cache hits that matched a near-duplicate
             'llm_calls': 0
         }
+        # LRU of (url, element_hash) -> llm_response, consulted before the store
+        self._mem: "OrderedDict[tuple, Dict[str, Any]]" = OrderedDict()
+        self._mem_size = memory_size
+    
+    def _remember(self, key: tuple, llm_response: Dict[str, Any]):
+        """Record a response in the LRU, evicting the oldest entry when full"""
+        self._mem[key] = llm_response
+        self._mem.move_to_end(key)
+        if len(self._mem) > self._mem_size:
+            self._mem.popitem(last=False)
+    
+    def forget_site(self, url: str):
+        """Drop remembered responses for a site"""
+        for key in [key for key in self._mem if key[0] == url]:
+            del self._mem[key]
     
     async def analyze_with_cache(self, url: str, element_data: Dict[str, Any], 
-                                 force_fresh: bool = False) -> Dict[str, Any]:
-        """Analyze element, using cache if available"""
+                                 force_fresh: bool = False) -> Tuple[Dict[str, Any], bool]:
+        """Analyze element, using cache if available
+        
+        Returns the analysis and whether it came from the cache.
+        """
+        
+        key = (url, self.store._compute_element_hash(element_data))
         
         if not force_fresh:
+            remembered = self._mem.get(key)
+            if remembered is not None:
+                self._mem.move_to_end(key)
+                self.stats['cache_hits'] += 1
+                return remembered, True
+            
             # Check for existing knowledge
-            existing = self.store.find_element_knowledge(url, element_data)
+            existing = self.store.find_element_knowledge(url, element_data, element_hash=key[1])
             if existing:
                 self.stats['cache_hits'] += 1
+                if existing.element_hash != key[1]:
+                    self.stats['near_hits'] += 1
                 logger.info(f"Using cached knowledge: {existing.understanding[:50]}...")
-                return existing.llm_response
+                self._remember(key, existing.llm_response)
+                return existing.llm_response, True
         
         # No cache or forced fresh - call LLM
         self.stats['llm_calls'] += 1
@@ -170,9 +368,10 @@ class KnowledgeAwareAnalyzer:
         }
         
         # Save to knowledge store
-        self.store.save_element_knowledge(url, element_data, llm_response)
+        self.store.save_element_knowledge(url, element_data, llm_response, element_hash=key[1])
+        self._remember(key, llm_response)
         
-        return llm_response
+        return llm_response, False
     
     def get_stats(self) -> Dict[str, int]:
         """Get analysis statistics"""
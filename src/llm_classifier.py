@@ -2,152 +2,864 @@
 Flexible LLM Classifier - src/llm_classifier.py
 No prescriptive categories, lets LLM understand naturally
 """
+import asyncio
+import atexit
 import json
+import hashlib
 import logging
-from typing import Dict, Any, Optional
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import Dict, Any, Optional, List, Tuple, Callable, Deque
 import os
+from functools import lru_cache
+
+from knowledge_store import simhash, SIMHASH_MAX_DISTANCE, DATA_DIR
+
+# orjson parses LLM responses noticeably faster when installed; its
+# JSONDecodeError subclasses json's, so error handling is the same
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# json5 accepts the trailing commas and unquoted keys LLMs sometimes emit.
+# It is far slower than json, so it's only a last resort when parsing fails
+try:
+    import json5
+except ImportError:
+    json5 = None
 
 logger = logging.getLogger(__name__)
 
+# Decodes a JSON value at an offset and reports where it ends, so an object
+# of any depth can be pulled out of surrounding prose in one linear scan
+_JSON_DECODER = json.JSONDecoder()
+
+# Mock-response heuristics, checked in order against a
+# "tag:...\nclass:...\ntext:..." summary of the element
+_MOCK_RULES = (
+    (re.compile(r'^tag:nav$|^class:.*nav', re.MULTILINE), {
+        "understanding": "This appears to be the main navigation menu for the website",
+        "purpose": "Helps users navigate to different sections of the site",
+        "user_intent": "Users want to find and access other pages or sections",
+        "confidence": 0.85,
+        "key_elements": ["navigation", "menu", "links"],
+        "notes": "Contains multiple navigation links"
+    }),
+    (re.compile(r'^tag:header$', re.MULTILINE), {
+        "understanding": "This is the site header containing branding and top-level navigation",
+        "purpose": "Establishes site identity and provides primary navigation",
+        "user_intent": "Users look here for site identification and main menu options",
+        "confidence": 0.9,
+        "key_elements": ["header", "branding", "top navigation"]
+    }),
+    (re.compile(r'^(?:tag|class):.*footer', re.MULTILINE), {
+        "understanding": "This is the website footer with supplementary information",
+        "purpose": "Provides additional links, legal info, and contact details",
+        "user_intent": "Users check here for contact info, policies, or sitemap",
+        "confidence": 0.8,
+        "key_elements": ["footer", "contact", "links"]
+    }),
+    (re.compile(r'^(?:class|text):.*search', re.MULTILINE), {
+        "understanding": "This appears to be a search interface for finding content",
+        "purpose": "Allows users to search for specific information on the site",
+        "user_intent": "Users want to quickly find specific content or pages",
+        "confidence": 0.75,
+        "key_elements": ["search", "input", "query"]
+    }),
+)
+
+
+class ResponseCache:
+    """Persistent cache of parsed LLM responses
+    
+    Lookups try the exact prompt first, then any element with the same tag
+    and clickability whose class/text signature is a near-duplicate
+    (SimHash within SIMHASH_MAX_DISTANCE bits). New entries are buffered and
+    appended to a JSONL file from a worker thread, and the file is
+    rewritten once superseded or evicted records outnumber live ones.
+    """
+    
+    # Most recent signatures kept per bucket for near-duplicate scans
+    BUCKET_SIZE = 256
+    # Seconds to gather new entries before appending them in one write
+    FLUSH_DELAY = 1.0
+    
+    def __init__(self, path: Path, max_entries: int = 20000):
+        self.path = path
+        self.max_entries = max_entries
+        # key -> (bucket, signature_hash, response), least recently used first
+        self.exact: "OrderedDict[str, Tuple[str, int, Dict[str, Any]]]" = OrderedDict()
+        self.similar: Dict[str, Deque[Tuple[int, str]]] = {}
+        self._pending: List[str] = []  # serialized entries not yet appended
+        self._log_lines = 0
+        # Flushes run in a worker thread while the event loop keeps adding
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._load()
+    
+    @classmethod
+    def shared(cls, path: Path) -> "ResponseCache":
+        """The process-wide cache for a file, so classifiers using the same
+        file share one copy and one writer, flushed at exit"""
+        path = path.resolve()
+        cache = _SHARED_CACHES.get(path)
+        if cache is None:
+            cache = _SHARED_CACHES[path] = cls(path)
+        return cache
+    
+    def _load(self):
+        """Replay the cache file; later entries win"""
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, 'r') as f:
+                for line in f:
+                    if line.strip():
+                        entry = _loads(line)
+                        self._remember(entry['key'], entry['bucket'],
+                                       entry['simhash'], entry['response'])
+                        self._log_lines += 1
+            logger.info(f"Loaded {len(self.exact)} cached LLM responses")
+        except Exception as e:
+            logger.error(f"Error loading LLM response cache: {e}")
+    
+    def _remember(self, key: str, bucket: str, signature_hash: int, response: Dict[str, Any]):
+        with self._lock:
+            if key not in self.exact and signature_hash:
+                self.similar.setdefault(bucket, deque(maxlen=self.BUCKET_SIZE)).append(
+                    (signature_hash, key)
+                )
+            self.exact[key] = (bucket, signature_hash, response)
+            self.exact.move_to_end(key)
+            if len(self.exact) > self.max_entries:
+                self.exact.popitem(last=False)
+    
+    def get(self, key: str, bucket: str, signature_hash: int) -> Optional[Dict[str, Any]]:
+        """Cached response for this prompt or a near-duplicate element"""
+        entry = self.exact.get(key)
+        if entry is not None:
+            self.exact.move_to_end(key)
+            return entry[2]
+        if not signature_hash:
+            return None
+        for other_hash, other_key in self.similar.get(bucket, ()):
+            if bin(signature_hash ^ other_hash).count('1') <= SIMHASH_MAX_DISTANCE:
+                entry = self.exact.get(other_key)  # None once evicted
+                if entry is not None:
+                    return entry[2]
+        return None
+    
+    def put(self, key: str, bucket: str, signature_hash: int, response: Dict[str, Any]):
+        """Store a response in memory; it reaches the cache file on the next flush"""
+        self._remember(key, bucket, signature_hash, response)
+        line = json.dumps({'key': key, 'bucket': bucket,
+                           'simhash': signature_hash, 'response': response}) + '\n'
+        with self._lock:
+            self._pending.append(line)
+        self._schedule_flush()
+    
+    def _schedule_flush(self):
+        """Start a background flush unless one is already waiting"""
+        if self._flush_task is not None and not self._flush_task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()  # No loop to hand the write to
+            return
+        self._flush_task = loop.create_task(self._flush_later())
+    
+    async def _flush_later(self):
+        while self._pending:
+            await asyncio.sleep(self.FLUSH_DELAY)
+            await asyncio.get_running_loop().run_in_executor(None, self.flush)
+    
+    def flush(self):
+        """Append buffered entries to the cache file (blocking)"""
+        with self._io_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, 'a') as f:
+                    f.write(''.join(batch))
+                self._log_lines += len(batch)
+                # Superseded and evicted records pile up over time
+                if self._log_lines > 2 * len(self.exact):
+                    self._compact()
+            except OSError as e:
+                logger.error(f"Error saving LLM responses: {e}")
+    
+    def _compact(self):
+        """Rewrite the cache file with only the live entries"""
+        with self._lock:
+            snapshot = list(self.exact.items())
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, 'w') as f:
+            for key, (bucket, signature_hash, response) in snapshot:
+                f.write(json.dumps({'key': key, 'bucket': bucket,
+                                    'simhash': signature_hash, 'response': response}) + '\n')
+        tmp_path.replace(self.path)
+        self._log_lines = len(snapshot)
+
+
+# Shared caches by resolved path; a delayed flush can be cut short by the
+# loop shutting down, so whatever is still buffered is written at exit
+_SHARED_CACHES: "weakref.WeakValueDictionary[Path, ResponseCache]" = weakref.WeakValueDictionary()
+
+
+@atexit.register
+def _flush_shared_caches():
+    for cache in list(_SHARED_CACHES.values()):
+        cache.flush()
+
+
+class RateLimiter:
+    """Client-side rate limiting for one provider
+    
+    Requests and (estimated) tokens each draw from a token bucket refilled
+    at rpm/tpm per minute; None disables that bucket. Concurrency follows
+    AIMD: a 429 halves the in-flight limit and pauses everyone for the
+    server's Retry-After, and each success grows the limit back by about
+    one per window of successful requests, up to max_concurrent.
+    """
+    
+    def __init__(self, rpm: Optional[int], tpm: Optional[int], max_concurrent: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrent = max_concurrent
+        self.limit = float(max_concurrent)
+        self.in_flight = 0
+        self._requests = float(rpm) if rpm else 0.0
+        self._tokens = float(tpm) if tpm else 0.0
+        self._refilled_at = time.monotonic()
+        self._blocked_until = 0.0
+        # Created on first use: before 3.10 asyncio primitives bind to the
+        # loop current at construction, which isn't the one asyncio.run uses
+        self._condition: Optional[asyncio.Condition] = None
+    
+    @property
+    def _changed(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+    
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60)
+    
+    def _wait_time(self, tokens: int) -> float:
+        """Seconds until a request of this size may start (0 if it can now)"""
+        self._refill()
+        wait = self._blocked_until - time.monotonic()
+        if self.rpm and self._requests < 1:
+            wait = max(wait, (1 - self._requests) * 60 / self.rpm)
+        if self.tpm:
+            tokens = min(tokens, self.tpm)  # oversized requests just wait for a full bucket
+            if self._tokens < tokens:
+                wait = max(wait, (tokens - self._tokens) * 60 / self.tpm)
+        return max(wait, 0.0)
+    
+    @asynccontextmanager
+    async def acquire(self, estimated_tokens: int):
+        """Hold a request slot for the duration of the block"""
+        async with self._changed:
+            while True:
+                if self.in_flight < int(self.limit):
+                    wait = self._wait_time(estimated_tokens)
+                    if wait == 0:
+                        break
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                else:
+                    await self._changed.wait()
+            self.in_flight += 1
+            if self.rpm:
+                self._requests -= 1
+            if self.tpm:
+                self._tokens -= estimated_tokens
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self.in_flight -= 1
+                self._changed.notify_all()
+    
+    def on_success(self):
+        """Additive increase: about +1 slot per window of successes"""
+        self.limit = min(self.max_concurrent, self.limit + 1 / max(self.limit, 1))
+    
+    def on_rate_limited(self, retry_after: Optional[float]):
+        """Multiplicative decrease, plus a global pause if the server asked for one"""
+        self.limit = max(1.0, self.limit * 0.5)
+        pause = retry_after if retry_after is not None else 1.0
+        self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+        logger.warning(f"Rate limited; concurrency now {int(self.limit)}, pausing {pause:.1f}s")
+
+
+def _rate_limit_retry_after(error: Exception) -> Tuple[bool, Optional[float]]:
+    """Whether an SDK/HTTP error is a 429, and its Retry-After in seconds"""
+    response = getattr(error, 'response', None)
+    status = (getattr(error, 'status_code', None) or getattr(error, 'status', None)
+              or getattr(response, 'status_code', None))
+    if status != 429:
+        return False, None
+    headers = getattr(response, 'headers', None) or getattr(error, 'headers', None) or {}
+    try:
+        return True, float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return True, None
+
+
+def _is_confident(response: Dict[str, Any]) -> bool:
+    """Whether a parsed response claims any confidence; models sometimes
+    send it as a string or null, which counts as none if it isn't a number"""
+    try:
+        return float(response.get('confidence') or 0.0) > 0.0
+    except (TypeError, ValueError):
+        return False
+
+
+def _estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), close enough for budgets"""
+    return len(text) // 4
+
+
+def _round10(value: float) -> int:
+    """Round a pixel value to the nearest 10"""
+    return int(round(value / 10.0)) * 10
+
+
+SYSTEM_PROMPT = "You are a web UX expert analyzing webpage elements."
+
+
+def _analysis_instructions(clickable: bool) -> str:
+    """The instruction and JSON-schema part of the prompt; the same for
+    every element of a kind, so it always goes first where providers can
+    cache it as a shared prefix"""
+    return f"""You are analyzing a section of a webpage. Describe what the element below is and its purpose in natural language.
+
+Provide a thoughtful analysis of:
+1. What this element/section represents (be specific and descriptive)
+2. Its purpose on the page
+3. What users likely want when they interact with it
+4. Your confidence level (0-1) in this analysis
+5. Key identifying features that led to your conclusion
+{f"6. What happens when users click this element" if clickable else ""}
+
+Don't constrain yourself to predefined categories. Describe it as you naturally understand it.
+
+Respond in JSON format:
+{{
+    "understanding": "Natural description of what this is",
+    "purpose": "What this helps users accomplish",
+    "user_intent": "What users likely want when they see/use this",
+    "confidence": 0.0-1.0,
+    "key_elements": ["identifying", "features"],
+    {'"click_behavior": "What happens when clicked",' if clickable else ''}
+    "notes": "Any additional observations"
+}}
+
+The element to analyze follows."""
+
+
+# Keyed by whether the element is clickable
+ANALYSIS_INSTRUCTIONS = {clickable: _analysis_instructions(clickable) for clickable in (False, True)}
+
+# Anthropic has no JSON mode; forcing this tool makes it return the
+# analysis as already-parsed tool input instead
+ANALYSIS_TOOL = {
+    "name": "record_analysis",
+    "description": "Record the analysis of the webpage element",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "understanding": {"type": "string"},
+            "purpose": {"type": "string"},
+            "user_intent": {"type": "string"},
+            "confidence": {"type": "number"},
+            "key_elements": {"type": "array", "items": {"type": "string"}},
+            "click_behavior": {"type": "string"},
+            "notes": {"type": "string"}
+        },
+        "required": ["understanding", "purpose", "confidence", "key_elements"]
+    }
+}
+
+# Instructions for several numbered elements answered in one request
+PACKED_INSTRUCTIONS = """You are analyzing several sections of a webpage. Describe what each numbered element below is and its purpose in natural language.
+
+For each element, provide a thoughtful analysis of:
+1. What this element/section represents (be specific and descriptive)
+2. Its purpose on the page
+3. What users likely want when they interact with it
+4. Your confidence level (0-1) in this analysis
+5. Key identifying features that led to your conclusion
+6. For clickable elements, what happens when users click them
+
+Don't constrain yourself to predefined categories. Describe each as you naturally understand it.
+
+Respond in JSON format, with exactly one analysis per element, in the order given:
+{
+    "analyses": [
+        {
+            "understanding": "Natural description of what this is",
+            "purpose": "What this helps users accomplish",
+            "user_intent": "What users likely want when they see/use this",
+            "confidence": 0.0-1.0,
+            "key_elements": ["identifying", "features"],
+            "click_behavior": "What happens when clicked (clickable elements only)",
+            "notes": "Any additional observations"
+        }
+    ]
+}
+
+The elements to analyze follow."""
+
+PACKED_ANALYSIS_TOOL = {
+    "name": "record_analyses",
+    "description": "Record the analysis of each webpage element, in order",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "analyses": {"type": "array", "items": ANALYSIS_TOOL["input_schema"]}
+        },
+        "required": ["analyses"]
+    }
+}
+
+
+@lru_cache(maxsize=4096)
+def _build_prompt_cached(tag: str, id_: str, cls: str, width: int, height: int,
+                         x: int, y: int, text_preview: str, clickable: bool,
+                         href: str, context_desc: str) -> str:
+    """Render the element-specific part of the prompt; pure, so repeated
+    elements hit the cache"""
+    
+    # Element details
+    element_desc = f"""Element Details:
+- Tag: <{tag}>
+- ID: {id_}
+- Classes: {cls}
+- Size: {width}x{height} pixels
+- Position: ({x}, {y})
+- Text preview: {text_preview}
+- Clickable: {clickable}
+- Href: {href}
+"""
+    
+    return element_desc + context_desc
+
 
 class FlexibleLLMClassifier:
     """LLM classifier that doesn't constrain to specific types"""
     
-    def __init__(self):
+    # Upper bound on instructions + element prompt, in estimated tokens
+    MAX_PROMPT_TOKENS = 800
+    
+    # Default number of concurrent requests per provider for batch analysis
+    PROVIDER_CONCURRENCY = {
+        'openai': 10,
+        'anthropic': 5,
+        'ollama': 2,
+        'groq': 8
+    }
+    
+    # Default (requests, tokens) per minute; None means no client-side limit.
+    # Override with LLM_RPM / LLM_TPM to match your account tier
+    PROVIDER_RATE_LIMITS = {
+        'openai': (500, 30000),
+        'anthropic': (50, 40000),
+        'ollama': (None, None),
+        'groq': (30, 6000)
+    }
+    
+    # Hosted providers and the variable holding their API key
+    API_KEY_ENV = {
+        'openai': 'OPENAI_API_KEY',
+        'anthropic': 'ANTHROPIC_API_KEY',
+        'groq': 'GROQ_API_KEY',
+    }
+    
+    # Attempts per element when the provider keeps answering 429
+    MAX_RATE_LIMIT_RETRIES = 3
+    
+    def __init__(self, cache_path: Optional[Path] = None):
         self.provider = os.getenv('LLM_PROVIDER', 'openai')
         self._setup_client()
+        rpm, tpm = self.PROVIDER_RATE_LIMITS.get(self.provider, (None, None))
+        self._limiter = RateLimiter(
+            rpm=int(os.getenv('LLM_RPM', 0)) or rpm,
+            tpm=int(os.getenv('LLM_TPM', 0)) or tpm,
+            max_concurrent=self.PROVIDER_CONCURRENCY.get(self.provider, 4)
+        )
+        # Defaults next to the site knowledge, not relative to the cwd
+        cache_path = cache_path or Path(os.getenv('LLM_CACHE_FILE') or DATA_DIR / 'llm_cache.jsonl')
+        self.response_cache = ResponseCache.shared(cache_path)
+        # Cache key -> result of the request currently fetching it
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Created inside a running loop, start connecting before the first element arrives
+        try:
+            self._prewarm_task = asyncio.get_running_loop().create_task(self._prewarm())
+        except RuntimeError:
+            self._prewarm_task = None
     
     def _setup_client(self):
         """Initialize LLM client based on provider"""
+        key_env = self.API_KEY_ENV.get(self.provider)
+        if key_env and not os.getenv(key_env):
+            # Without a key every query fails and falls back to mock responses
+            logger.warning(f"{key_env} is not set; {self.provider} analysis will use mock responses")
+            self.client = None
+            return
+        
+        # Async clients, so requests run on the event loop instead of blocking it
         if self.provider == 'openai':
-            import openai
-            openai.api_key = os.getenv('OPENAI_API_KEY')
-            self.client = openai
+            from openai import AsyncOpenAI
+            self.client = AsyncOpenAI(api_key=os.getenv('OPENAI_API_KEY'))
             self.model = os.getenv('OPENAI_MODEL', 'gpt-4-turbo-preview')
         elif self.provider == 'anthropic':
-            from anthropic import Anthropic
-            self.client = Anthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
+            from anthropic import AsyncAnthropic
+            self.client = AsyncAnthropic(api_key=os.getenv('ANTHROPIC_API_KEY'))
             self.model = os.getenv('ANTHROPIC_MODEL', 'claude-3-sonnet-20240229')
         elif self.provider == 'ollama':
             self.base_url = os.getenv('OLLAMA_URL', 'http://localhost:11434')
             self.model = os.getenv('OLLAMA_MODEL', 'llama2')
+            self._http = None  # Created on first use, inside the event loop
         elif self.provider == 'groq':
-            from groq import Groq
-            self.client = Groq(api_key=os.getenv('GROQ_API_KEY'))
+            from groq import AsyncGroq
+            self.client = AsyncGroq(api_key=os.getenv('GROQ_API_KEY'))
             self.model = os.getenv('GROQ_MODEL', 'mixtral-8x7b-32768')
     
+    async def _prewarm(self):
+        """Pay connection setup (and Ollama's model load) ahead of the first
+        request; a failure here only means that request is slower"""
+        try:
+            if self.provider == 'ollama':
+                http = await self._get_http()
+                # A generate request with no prompt just loads the model
+                await http.post(f"{self.base_url}/api/generate", json={"model": self.model})
+            elif self.provider in ('openai', 'groq') and self.client is not None:
+                # A cheap authenticated call opens the SDK's own pooled connection
+                await self.client.models.list()
+        except Exception as e:
+            logger.debug(f"Prewarming {self.provider} failed: {e}")
+    
     async def analyze_element(self, element_data: Dict[str, Any], 
                             context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """Analyze element with full flexibility"""
         
         prompt = self._build_flexible_prompt(element_data, context)
+        instructions = ANALYSIS_INSTRUCTIONS[bool(element_data.get('clickable'))]
+        
+        # Similar elements (repeated cards, links, ...) reuse an earlier answer
+        key, bucket, signature_hash = self._cache_identity(element_data, prompt, instructions)
+        cached = self.response_cache.get(key, bucket, signature_hash)
+        if cached is not None:
+            return cached
         
+        # An identical prompt already in flight answers this one too
+        pending = self._inflight.get(key)
+        if pending is not None:
+            parsed = await asyncio.shield(pending)
+            if parsed is not None:
+                return parsed
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
         try:
-            response = await self._query_llm(prompt)
-            return self._parse_response(response)
-        except Exception as e:
-            logger.error(f"LLM analysis failed: {e}")
-            return self._mock_response(element_data)  # Fallback for testing
+            try:
+                response = await self._query_llm_limited(prompt, instructions)
+                parsed = self._parse_response(response)
+            except Exception as e:
+                logger.error(f"LLM analysis failed: {e}")
+                parsed = self._mock_response(element_data)  # Fallback for testing
+            else:
+                # Zero-confidence answers (including unparseable ones) aren't worth reusing
+                if _is_confident(parsed):
+                    self.response_cache.put(key, bucket, signature_hash, parsed)
+            future.set_result(parsed)
+        finally:
+            if not future.done():
+                future.set_result(None)  # Cancelled; waiters make their own request
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+        return parsed
+    
+    def _cache_identity(self, element_data: Dict[str, Any], prompt: str,
+                        instructions: str) -> Tuple[str, str, int]:
+        """Response-cache key, similarity bucket and signature for one element"""
+        model = f"{self.provider}:{getattr(self, 'model', '')}"
+        key = hashlib.blake2b(f"{model}:{prompt}:{instructions}".encode(), digest_size=16).hexdigest()
+        bucket = f"{model}:{element_data.get('tagName')}:{bool(element_data.get('clickable'))}"
+        signature_hash = simhash(f"{element_data.get('className', '')} {element_data.get('text', '')}")
+        return key, bucket, signature_hash
+    
+    async def analyze_elements_batch(self, elements: List[Dict[str, Any]],
+                                     context_fn: Optional[Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]] = None,
+                                     max_concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Analyze many elements concurrently, results in input order"""
+        limit = max_concurrency or self.PROVIDER_CONCURRENCY.get(self.provider, 4)
+        sem = asyncio.Semaphore(limit)
+        
+        async def _one(element_data):
+            async with sem:
+                context = context_fn(element_data) if context_fn else None
+                return await self.analyze_element(element_data, context)
+        
+        results = await asyncio.gather(*[_one(e) for e in elements], return_exceptions=True)
+        return [
+            self._mock_response(element_data) if isinstance(result, Exception) else result
+            for element_data, result in zip(elements, results)
+        ]
+    
+    async def analyze_elements_packed(self, elements: List[Dict[str, Any]], pack_size: int = 5,
+                                      context_fn: Optional[Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]] = None,
+                                      max_concurrency: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Analyze elements several to a request, results in input order
+        
+        Elements already in the response cache are answered from it and the
+        rest are sent pack_size to a prompt, so the instructions are paid
+        for once per pack. A pack whose answer doesn't line up with its
+        elements falls back to one request per element.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(elements)
+        pending = []  # (index, context, prompt, cache identity)
+        for index, element_data in enumerate(elements):
+            context = context_fn(element_data) if context_fn else None
+            prompt = self._build_flexible_prompt(element_data, context)
+            identity = self._cache_identity(
+                element_data, prompt, ANALYSIS_INSTRUCTIONS[bool(element_data.get('clickable'))]
+            )
+            results[index] = self.response_cache.get(*identity)
+            if results[index] is None:
+                pending.append((index, context, prompt, identity))
+        
+        limit = max_concurrency or self.PROVIDER_CONCURRENCY.get(self.provider, 4)
+        sem = asyncio.Semaphore(limit)
+        
+        async def _pack(pack):
+            prompt = "\n\n".join(f"Element {n}:\n{item[2]}" for n, item in enumerate(pack, 1))
+            analyses = None
+            async with sem:
+                try:
+                    response = await self._query_llm_limited(
+                        prompt, PACKED_INSTRUCTIONS,
+                        max_tokens=400 * len(pack), tool=PACKED_ANALYSIS_TOOL
+                    )
+                    analyses = self._parse_response(response).get('analyses')
+                except Exception as e:
+                    logger.error(f"Packed LLM analysis failed: {e}")
+            
+            if (not isinstance(analyses, list) or len(analyses) != len(pack)
+                    or not all(isinstance(a, dict) for a in analyses)):
+                analyses = await asyncio.gather(*[
+                    self.analyze_element(elements[index], context)
+                    for index, context, _, _ in pack
+                ])
+                for (index, _, _, _), analysis in zip(pack, analyses):
+                    results[index] = analysis
+                return
+            
+            for (index, _, _, identity), analysis in zip(pack, analyses):
+                results[index] = analysis
+                if _is_confident(analysis):
+                    self.response_cache.put(*identity, analysis)
+        
+        await asyncio.gather(*[
+            _pack(pending[start:start + pack_size])
+            for start in range(0, len(pending), pack_size)
+        ])
+        return results
     
     def _build_flexible_prompt(self, element_data: Dict[str, Any], 
                               context: Optional[Dict[str, Any]] = None) -> str:
-        """Build unconstrained prompt for natural understanding"""
-        
-        # Element details
-        element_desc = f"""
-Element Details:
-- Tag: <{element_data.get('tagName', 'unknown')}>
-- ID: {element_data.get('id', 'none')}
-- Classes: {element_data.get('className', 'none')}
-- Size: {element_data.get('rect', {}).get('width', 0)}x{element_data.get('rect', {}).get('height', 0)} pixels
-- Position: ({element_data.get('rect', {}).get('x', 0)}, {element_data.get('rect', {}).get('y', 0)})
-- Text preview: {element_data.get('text', 'No text')[:200]}
-- Clickable: {element_data.get('clickable', False)}
-- Href: {element_data.get('href', 'none') if element_data.get('clickable') else 'N/A'}
-"""
+        """Build the element-specific part of the prompt for natural understanding
+        
+        The static instructions that precede it live in ANALYSIS_INSTRUCTIONS.
+        """
         
         # Add context if available
-        context_desc = ""
+        parent_desc = siblings_desc = children_desc = ""
         if context:
             if context.get('parent'):
-                context_desc += f"\nParent element: {context['parent'].get('understanding', 'Unknown')}"
+                # The parent's understanding is LLM output, so it has no natural bound
+                parent_desc = f"\nParent element: {context['parent'].get('understanding', 'Unknown')[:200]}"
             if context.get('siblings'):
-                context_desc += f"\nSibling elements: {', '.join(s.get('tag', '') for s in context['siblings'][:3])}"
+                siblings_desc = f"\nSibling elements: {', '.join(s.get('tag', '') for s in context['siblings'][:3])}"
             if context.get('children'):
-                context_desc += f"\nChild elements: {', '.join(c.get('tag', '') + (f' ({c.get("text", "")[:20]}...)' if c.get("text") else '') for c in context['children'][:5])}"
+                parts = []
+                for child in context['children'][:5]:
+                    child_tag = child.get('tag', '')
+                    child_text = child.get('text', '')
+                    parts.append(f"{child_tag} ({child_text[:20]}...)" if child_text else child_tag)
+                children_desc = "\nChild elements: " + ", ".join(parts)
         
-        return f"""You are analyzing a section of a webpage. Describe what this element is and its purpose in natural language.
-
-{element_desc}
-{context_desc}
-
-Provide a thoughtful analysis of:
-1. What this element/section represents (be specific and descriptive)
-2. Its purpose on the page
-3. What users likely want when they interact with it
-4. Your confidence level (0-1) in this analysis
-5. Key identifying features that led to your conclusion
-{f"6. What happens when users click this element" if element_data.get('clickable') else ""}
-
-Don't constrain yourself to predefined categories. Describe it as you naturally understand it.
-
-Respond in JSON format:
-{{
-    "understanding": "Natural description of what this is",
-    "purpose": "What this helps users accomplish",
-    "user_intent": "What users likely want when they see/use this",
-    "confidence": 0.0-1.0,
-    "key_elements": ["identifying", "features"],
-    {'"click_behavior": "What happens when clicked",' if element_data.get('clickable') else ''}
-    "notes": "Any additional observations"
-}}"""
+        clickable = element_data.get('clickable', False)
+        text = element_data.get('text', 'No text')[:200]
+        # Read every field once; re-renders below only vary context and text.
+        # Free-form attributes are capped (utility-class lists and tracking
+        # URLs run to kilobytes) so the fully trimmed prompt always fits
+        rect = element_data.get('rect', {})
+        fields = (
+            element_data.get('tagName', 'unknown'),
+            element_data.get('id', 'none')[:200],
+            element_data.get('className', 'none')[:200],
+            # Geometry is rounded to 10px so repeated layouts share cache entries
+            _round10(rect.get('width', 0)),
+            _round10(rect.get('height', 0)),
+            _round10(rect.get('x', 0)),
+            _round10(rect.get('y', 0)),
+        )
+        href = element_data.get('href', 'none')[:200] if clickable else 'N/A'
+        
+        def render(context_desc: str, text_preview: str) -> str:
+            return _build_prompt_cached(*fields, text_preview, clickable, href, context_desc)
+        
+        prompt = render(parent_desc + siblings_desc + children_desc, text)
+        budget = self.MAX_PROMPT_TOKENS - _estimate_tokens(ANALYSIS_INSTRUCTIONS[bool(clickable)])
+        # Over budget: drop the least informative context first, then
+        # shorten the element's own text, then drop the parent too
+        for context_desc, text_preview in ((parent_desc + children_desc, text),
+                                           (parent_desc, text),
+                                           (parent_desc, text[:100]),
+                                           ("", text[:100])):
+            if _estimate_tokens(prompt) <= budget:
+                break
+            prompt = render(context_desc, text_preview)
+        return prompt
+    
+    async def _get_http(self):
+        """Shared httpx client, so Ollama requests reuse keep-alive connections"""
+        if self._http is None or self._http.is_closed:
+            import httpx
+            parallel = int(os.getenv('OLLAMA_NUM_PARALLEL', '8'))
+            # Ollama serves plain HTTP/1.1, so concurrency comes from a
+            # pool sized to the server's parallel slots, not multiplexing
+            self._http = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=parallel,
+                                    max_keepalive_connections=parallel),
+                timeout=60.0
+            )
+        return self._http
+    
+    async def close(self):
+        """Release the HTTP client, if one was opened, and save cached responses"""
+        task = getattr(self, '_prewarm_task', None)
+        if task is not None and not task.done():
+            task.cancel()
+        await asyncio.get_running_loop().run_in_executor(None, self.response_cache.flush)
+        http = getattr(self, '_http', None)
+        if http is not None and not http.is_closed:
+            await http.aclose()
+    
+    async def _query_llm_limited(self, prompt: str, instructions: str,
+                                 max_tokens: int = 400, tool: Dict[str, Any] = ANALYSIS_TOOL) -> str:
+        """Query the LLM through the rate limiter, retrying on 429s"""
+        # Prompt plus the response budget
+        estimated_tokens = _estimate_tokens(prompt) + _estimate_tokens(instructions) + max_tokens
+        for attempt in range(self.MAX_RATE_LIMIT_RETRIES):
+            async with self._limiter.acquire(estimated_tokens):
+                try:
+                    response = await self._query_llm(prompt, instructions, max_tokens, tool)
+                except Exception as e:
+                    rate_limited, retry_after = _rate_limit_retry_after(e)
+                    if not rate_limited or attempt == self.MAX_RATE_LIMIT_RETRIES - 1:
+                        raise
+                    self._limiter.on_rate_limited(retry_after)
+                    continue
+            self._limiter.on_success()
+            return response
     
-    async def _query_llm(self, prompt: str) -> str:
-        """Query the LLM"""
+    async def _query_llm(self, prompt: str, instructions: str,
+                         max_tokens: int = 400, tool: Dict[str, Any] = ANALYSIS_TOOL) -> str:
+        """Query the LLM with the element prompt and the static instructions
+        
+        Anthropic answers through tool, which must match the JSON the
+        instructions ask for.
+        """
+        if self.provider in self.API_KEY_ENV and self.client is None:
+            raise RuntimeError(f"{self.API_KEY_ENV[self.provider]} is not set")
+        
+        # Static text always leads and per-element text always trails, so
+        # every request for a kind of element shares one cacheable prefix
         if self.provider == 'openai':
-            response = await self.client.ChatCompletion.acreate(
+            response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=[
-                    {"role": "system", "content": "You are a web UX expert analyzing webpage elements."},
+                    {"role": "system", "content": f"{SYSTEM_PROMPT}\n\n{instructions}"},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.3,
-                max_tokens=400
+                max_tokens=max_tokens,
+                response_format={"type": "json_object"}
             )
             return response.choices[0].message.content
             
         elif self.provider == 'anthropic':
+            # The static instructions go first, marked as a cacheable prefix,
+            # so repeat calls only pay full price for the element details
             response = await self.client.messages.create(
                 model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=400,
+                system=SYSTEM_PROMPT,
+                messages=[{"role": "user", "content": [
+                    {"type": "text", "text": instructions,
+                     "cache_control": {"type": "ephemeral"}},
+                    {"type": "text", "text": prompt}
+                ]}],
+                tools=[tool],
+                tool_choice={"type": "tool", "name": tool["name"]},
+                max_tokens=max_tokens,
                 temperature=0.3
             )
+            for block in response.content:
+                if block.type == "tool_use":
+                    return json.dumps(block.input)
             return response.content[0].text
             
         elif self.provider == 'ollama':
-            import aiohttp
-            async with aiohttp.ClientSession() as session:
-                async with session.post(
-                    f"{self.base_url}/api/generate",
-                    json={
-                        "model": self.model,
-                        "prompt": prompt,
-                        "stream": False
-                    }
-                ) as response:
-                    result = await response.json()
-                    return result.get("response", "{}")
+            http = await self._get_http()
+            response = await http.post(
+                f"{self.base_url}/api/generate",
+                json={
+                    "model": self.model,
+                    "system": SYSTEM_PROMPT,
+                    "prompt": f"{instructions}\n\n{prompt}",
+                    "format": "json",
+                    "options": {"num_predict": max_tokens},
+                    "stream": False
+                }
+            )
+            response.raise_for_status()
+            return response.json().get("response", "{}")
                     
         elif self.provider == 'groq':
             response = await self.client.chat.completions.create(
                 model=self.model,
                 messages=[
-                    {"role": "system", "content": "You are a web UX expert analyzing webpage elements."},
+                    {"role": "system", "content": f"{SYSTEM_PROMPT}\n\n{instructions}"},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.3,
-                max_tokens=400
+                max_tokens=max_tokens,
+                response_format={"type": "json_object"}
             )
             return response.choices[0].message.content
         
@@ -155,15 +867,37 @@ Respond in JSON format:
     
     def _parse_response(self, response: str) -> Dict[str, Any]:
         """Parse LLM response flexibly"""
+        if not isinstance(response, str):
+            response = ""
         try:
-            # Find JSON in response
-            import re
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                return json.loads(json_match.group())
-        except:
-            logger.error(f"Failed to parse LLM response: {response[:200]}")
+            # Every provider is asked for bare JSON, so this is the normal path
+            parsed = _loads(response)
+            if isinstance(parsed, dict):
+                return parsed
+        except ValueError:
+            pass
+        
+        # Older local models can still ignore JSON mode and wrap it in prose
+        start = response.find('{')
+        candidate = response
+        if start != -1:
+            try:
+                parsed, _ = _JSON_DECODER.raw_decode(response, start)
+                if isinstance(parsed, dict):
+                    return parsed
+            except ValueError:
+                pass
+            candidate = response[start:response.rfind('}') + 1]
         
+        if json5 is not None:
+            try:
+                parsed = json5.loads(candidate)
+                if isinstance(parsed, dict):
+                    return parsed
+            except Exception:
+                pass
+        
+        logger.error(f"Failed to parse LLM response: {response[:200]}")
         return {
             "understanding": "Unable to analyze",
             "purpose": "Unknown",
@@ -176,46 +910,21 @@ Respond in JSON format:
         tag = element_data.get('tagName', 'div')
         text = element_data.get('text', '')[:50]
         
-        # Simple heuristics for testing
-        if tag == 'nav' or 'nav' in element_data.get('className', ''):
-            return {
-                "understanding": "This appears to be the main navigation menu for the website",
-                "purpose": "Helps users navigate to different sections of the site",
-                "user_intent": "Users want to find and access other pages or sections",
-                "confidence": 0.85,
-                "key_elements": ["navigation", "menu", "links"],
-                "notes": "Contains multiple navigation links"
-            }
-        elif tag == 'header':
-            return {
-                "understanding": "This is the site header containing branding and top-level navigation",
-                "purpose": "Establishes site identity and provides primary navigation",
-                "user_intent": "Users look here for site identification and main menu options",
-                "confidence": 0.9,
-                "key_elements": ["header", "branding", "top navigation"]
-            }
-        elif 'footer' in tag or 'footer' in element_data.get('className', ''):
-            return {
-                "understanding": "This is the website footer with supplementary information",
-                "purpose": "Provides additional links, legal info, and contact details",
-                "user_intent": "Users check here for contact info, policies, or sitemap",
-                "confidence": 0.8,
-                "key_elements": ["footer", "contact", "links"]
-            }
-        elif 'search' in element_data.get('className', '') or 'search' in text.lower():
-            return {
-                "understanding": "This appears to be a search interface for finding content",
-                "purpose": "Allows users to search for specific information on the site",
-                "user_intent": "Users want to quickly find specific content or pages",
-                "confidence": 0.75,
-                "key_elements": ["search", "input", "query"]
-            }
-        else:
-            return {
-                "understanding": f"This is a {tag} element that appears to contain {('content' if text else 'structural layout')}",
-                "purpose": "Organizes or presents information on the page",
-                "user_intent": "Users may read or interact with this content",
-                "confidence": 0.4,
-                "key_elements": [tag, "content" if text else "layout"],
-                "notes": "Generic element without clear semantic markers"
-            }
\ No newline at end of file
+        # Simple heuristics for testing: one pass over a labeled summary.
+        # Fields are flattened to one line each so the rules' line anchors
+        # only ever see the separators, never newlines from the page
+        cls = ' '.join(element_data.get('className', '').split())
+        blob = f"tag:{tag}\nclass:{cls}\ntext:{' '.join(text.lower().split())}"
+        for pattern, response in _MOCK_RULES:
+            if pattern.search(blob):
+                return dict(response)
+        
+        has_text = bool(text)
+        return {
+            "understanding": f"This is a {tag} element that appears to contain {'content' if has_text else 'structural layout'}",
+            "purpose": "Organizes or presents information on the page",
+            "user_intent": "Users may read or interact with this content",
+            "confidence": 0.4,
+            "key_elements": [tag, "content" if has_text else "layout"],
+            "notes": "Generic element without clear semantic markers"
+        }
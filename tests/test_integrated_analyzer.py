@@ -0,0 +1,117 @@
+"""Tests for src/integrated_analyzer.py, with the page controls faked"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("playwright")
+
+import integrated_analyzer
+from integrated_analyzer import IntegratedWebAnalyzer
+from knowledge_store import KnowledgeStore
+
+URL = "https://example.com/"
+
+
+class FakeControls:
+    """Records what the analyzer asks the page to show"""
+    
+    def __init__(self):
+        self.version = None
+        self.statuses = []
+        self.drawn = []
+        self.is_analyzing = False
+    
+    async def update_status(self, text, color="#4CAF50"):
+        self.statuses.append(text)
+    
+    async def update_stats(self, stats):
+        pass
+    
+    async def inject_control_overlay(self, has_cached_knowledge=False):
+        pass
+    
+    async def overlay_version(self):
+        return self.version
+    
+    async def clear_overlays(self):
+        self.version = None
+    
+    async def create_element_overlays(self, items, version=None):
+        self.drawn.append(items)
+        self.version = version
+
+
+class FakePage:
+    """Counts navigations; a navigation wipes the page-side overlays"""
+    
+    def __init__(self, controls):
+        self.controls = controls
+        self.url = "about:blank"
+        self.navigations = 0
+    
+    async def goto(self, url, wait_until=None):
+        self.url = url
+        self.navigations += 1
+        self.controls.version = None
+    
+    async def wait_for_load_state(self, state, timeout=None):
+        pass
+
+
+@pytest.fixture
+def analyzer(monkeypatch, tmp_path):
+    monkeypatch.setattr(integrated_analyzer, 'KnowledgeStore', lambda: KnowledgeStore(tmp_path))
+    analyzer = IntegratedWebAnalyzer(headless=True)
+    analyzer.controls = FakeControls()
+    analyzer.current_url = URL
+    elements = [
+        {'tagName': 'nav', 'id': '', 'className': 'menu', 'text': 'Home About',
+         'rect': {'x': 0, 'y': 0, 'width': 800, 'height': 60}},
+        {'tagName': 'main', 'id': 'content', 'className': '', 'text': 'Welcome',
+         'rect': {'x': 0, 'y': 60, 'width': 800, 'height': 600}},
+    ]
+    
+    async def extract():
+        return [dict(e, element=object()) for e in elements]
+    
+    analyzer._extract_page_elements = extract
+    return analyzer
+
+
+def test_second_run_on_unchanged_page_is_skipped(analyzer):
+    asyncio.run(analyzer._run_analysis())
+    asyncio.run(analyzer._run_analysis())
+    
+    assert len(analyzer.controls.drawn) == 1
+    assert analyzer.controls.statuses[-1] == "Unchanged since last analysis"
+
+
+def test_forced_run_redraws_unchanged_page(analyzer):
+    asyncio.run(analyzer._run_analysis())
+    asyncio.run(analyzer._run_analysis(force_fresh=True))
+    
+    assert len(analyzer.controls.drawn) == 2
+
+
+def test_reentering_the_open_page_reuses_its_overlays(analyzer):
+    analyzer.page = FakePage(analyzer.controls)
+    
+    async def run():
+        await analyzer.analyze_url(URL)
+        await analyzer.analyze_url(URL)
+    
+    asyncio.run(run())
+    assert analyzer.page.navigations == 1
+    assert len(analyzer.controls.drawn) == 1
+    assert analyzer.controls.statuses[-1] == "Cached analysis already shown"
+
+
+def test_forced_reentry_navigates_again(analyzer):
+    analyzer.page = FakePage(analyzer.controls)
+    
+    async def run():
+        await analyzer.analyze_url(URL)
+        await analyzer.analyze_url(URL, force_fresh=True)
+    
+    asyncio.run(run())
+    assert analyzer.page.navigations == 2
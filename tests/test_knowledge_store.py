@@ -0,0 +1,34 @@
+"""Tests for src/knowledge_store.py"""
+import pytest
+
+from knowledge_store import KnowledgeStore
+
+URL = "https://example.com/"
+ELEMENT = {'tagName': 'nav', 'id': '', 'className': 'menu', 'text': 'Home About',
+           'rect': {'x': 0, 'y': 0, 'width': 800, 'height': 60}}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return KnowledgeStore(data_dir=tmp_path)
+
+
+def test_resave_during_flush_stays_pending(store):
+    store.save_element_knowledge(URL, ELEMENT, {'understanding': 'old', 'confidence': 0.5})
+    written = dict(store._dirty[URL])  # what a flush in a worker thread would write
+    store.save_element_knowledge(URL, ELEMENT, {'understanding': 'new', 'confidence': 0.9})
+    store._mark_clean(URL, written)
+    
+    pending = list(store._dirty[URL].values())
+    assert [k.llm_response['understanding'] for k in pending] == ['new']
+
+
+def test_flush_then_reload_returns_latest(store, tmp_path):
+    store.save_element_knowledge(URL, ELEMENT, {'understanding': 'old', 'confidence': 0.5})
+    store.flush_all()
+    store.save_element_knowledge(URL, ELEMENT, {'understanding': 'new', 'confidence': 0.9})
+    store.flush_all()
+    assert URL not in store._dirty
+    
+    reloaded = KnowledgeStore(data_dir=tmp_path).find_element_knowledge(URL, ELEMENT)
+    assert reloaded.llm_response['understanding'] == 'new'
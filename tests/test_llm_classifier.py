@@ -0,0 +1,344 @@
+"""Tests for src/llm_classifier.py, run against the mock provider"""
+import asyncio
+import json
+
+import pytest
+
+import llm_classifier
+from llm_classifier import FlexibleLLMClassifier
+
+
+@pytest.fixture
+def classifier(monkeypatch, tmp_path):
+    monkeypatch.setenv('LLM_PROVIDER', 'mock')
+    monkeypatch.setenv('LLM_CACHE_FILE', str(tmp_path / 'llm_cache.jsonl'))
+    return FlexibleLLMClassifier()
+
+
+def _reference_mock_kind(element_data):
+    """The original if/elif heuristics the rule table replaced"""
+    tag = element_data.get('tagName', 'div')
+    text = element_data.get('text', '')[:50]
+    if tag == 'nav' or 'nav' in element_data.get('className', ''):
+        return 'navigation'
+    elif tag == 'header':
+        return 'header'
+    elif 'footer' in tag or 'footer' in element_data.get('className', ''):
+        return 'footer'
+    elif 'search' in element_data.get('className', '') or 'search' in text.lower():
+        return 'search'
+    return tag
+
+
+@pytest.mark.parametrize('element_data', [
+    {'tagName': 'nav'},
+    {'tagName': 'div', 'className': 'top-nav'},
+    {'tagName': 'header', 'className': 'site'},
+    {'tagName': 'footer'},
+    {'tagName': 'div', 'className': 'page-footer'},
+    {'tagName': 'div', 'className': 'search-box'},
+    {'tagName': 'div', 'text': 'Search the site'},
+    {'tagName': 'div', 'text': 'Welcome\nSearch our site'},
+    {'tagName': 'div', 'text': 'x\ntag:nav'},
+    {'tagName': 'div', 'text': 'x\nclass:footer'},
+    {'tagName': 'div', 'className': 'a\nnavbar'},
+    {'tagName': 'div', 'className': 'Navbar'},
+    {'tagName': 'div', 'text': 'a' * 50 + 'search'},
+    {'tagName': 'section', 'text': 'Plain content'},
+    {'tagName': 'div'},
+])
+def test_mock_rules_match_original_heuristics(classifier, element_data):
+    response = classifier._mock_response(element_data)
+    assert response['key_elements'][0] == _reference_mock_kind(element_data)
+
+
+@pytest.mark.parametrize('response, expected', [
+    ('{"understanding": "nav", "confidence": 0.9}', {'understanding': 'nav', 'confidence': 0.9}),
+    ('Here: {"a": {"b": {"c": 1}}} done', {'a': {'b': {'c': 1}}}),
+    ('Sure! {"analyses": [{"understanding": "x", "key_elements": {"k": {}}}]}',
+     {'analyses': [{'understanding': 'x', 'key_elements': {'k': {}}}]}),
+])
+def test_parse_response_extracts_whole_object(classifier, response, expected):
+    assert classifier._parse_response(response) == expected
+
+
+@pytest.mark.parametrize('response', ['no json here', '[1, 2]', '{"unterminated": ', None])
+def test_parse_response_falls_back_to_zero_confidence(classifier, response):
+    parsed = classifier._parse_response(response)
+    assert parsed['confidence'] == 0.0
+    assert parsed['understanding'] == 'Unable to analyze'
+
+
+def test_prompt_stays_within_token_budget(classifier):
+    element_data = {
+        'tagName': 'div', 'id': 'i' * 1000, 'className': 'c ' * 2000,
+        'text': 't' * 1000, 'clickable': True, 'href': 'https://x/' + 'q' * 2000,
+    }
+    context = {
+        'parent': {'understanding': 'p' * 4000},
+        'siblings': [{'tag': 'section'}] * 3,
+        'children': [{'tag': 'a', 'text': 'child text'}] * 5,
+    }
+    prompt = classifier._build_flexible_prompt(element_data, context)
+    instructions = llm_classifier.ANALYSIS_INSTRUCTIONS[True]
+    tokens = llm_classifier._estimate_tokens(prompt) + llm_classifier._estimate_tokens(instructions)
+    assert tokens <= classifier.MAX_PROMPT_TOKENS
+
+
+def test_prompt_keeps_context_when_under_budget(classifier):
+    context = {'parent': {'understanding': 'Main content'}, 'children': [{'tag': 'a', 'text': 'Home'}]}
+    prompt = classifier._build_flexible_prompt({'tagName': 'nav', 'text': 'Home'}, context)
+    assert 'Parent element: Main content' in prompt
+    assert 'Child elements: a (Home...)' in prompt
+
+
+def test_response_cache_persists_and_finds_near_duplicates(tmp_path):
+    path = tmp_path / 'cache.jsonl'
+    cache = llm_classifier.ResponseCache(path)
+    cache.put('k1', 'm:div:False', 0b1011, {'understanding': 'card'})
+    
+    reloaded = llm_classifier.ResponseCache(path)
+    assert reloaded.get('k1', 'm:div:False', 0b1011) == {'understanding': 'card'}
+    assert reloaded.get('other', 'm:div:False', 0b1010) == {'understanding': 'card'}
+    assert reloaded.get('other', 'm:a:True', 0b1010) is None
+
+
+def test_response_cache_evicts_and_compacts(tmp_path):
+    path = tmp_path / 'cache.jsonl'
+    cache = llm_classifier.ResponseCache(path, max_entries=3)
+    for n in range(10):
+        cache.put(f'k{n}', 'b', 0, {'n': n})
+    
+    assert list(cache.exact) == ['k7', 'k8', 'k9']
+    assert len(path.read_text().splitlines()) <= 2 * cache.max_entries
+    reloaded = llm_classifier.ResponseCache(path, max_entries=3)
+    assert reloaded.get('k9', 'b', 0) == {'n': 9}
+    assert reloaded.get('k0', 'b', 0) is None
+
+
+def test_response_cache_batches_writes_off_the_loop(tmp_path, monkeypatch):
+    path = tmp_path / 'cache.jsonl'
+    cache = llm_classifier.ResponseCache(path)
+    monkeypatch.setattr(cache, 'FLUSH_DELAY', 0.01)
+    
+    async def put_many():
+        for n in range(5):
+            cache.put(f'k{n}', 'b', 0, {'n': n})
+        assert not path.exists()  # Nothing written from the loop itself
+        await cache._flush_task
+    
+    asyncio.run(put_many())
+    assert len(path.read_text().splitlines()) == 5
+
+
+class _RateLimited(Exception):
+    """Stands in for an SDK's 429 error"""
+    status_code = 429
+    
+    def __init__(self, retry_after):
+        super().__init__("429")
+        self.headers = {'retry-after': retry_after}
+
+
+def test_rate_limiter_token_buckets_set_the_wait():
+    limiter = llm_classifier.RateLimiter(rpm=60, tpm=6000, max_concurrent=4)
+    assert limiter._wait_time(100) == 0
+    
+    limiter._requests = 0  # one request refills per second
+    assert 0.9 < limiter._wait_time(100) <= 1.0
+    
+    limiter._requests, limiter._tokens = 60, 0  # 100 tokens refill per second
+    assert 1.9 < limiter._wait_time(200) <= 2.0
+    # Requests larger than the bucket wait for a full bucket, not forever
+    assert limiter._wait_time(10 ** 6) <= 60
+
+
+def test_rate_limiter_aimd_and_retry_after():
+    limiter = llm_classifier.RateLimiter(rpm=None, tpm=None, max_concurrent=8)
+    limiter.on_rate_limited(2.0)
+    assert limiter.limit == 4
+    assert 1.9 < limiter._wait_time(0) <= 2.0
+    
+    for _ in range(4):
+        limiter.on_success()
+    assert 4.9 < limiter.limit < 5.1
+    
+    for _ in range(10):
+        limiter.on_rate_limited(None)
+    assert limiter.limit == 1
+    for _ in range(1000):
+        limiter.on_success()
+    assert limiter.limit == 8
+
+
+def test_rate_limiter_caps_in_flight_requests():
+    limiter = llm_classifier.RateLimiter(rpm=None, tpm=None, max_concurrent=2)
+    peak = 0
+    
+    async def request():
+        nonlocal peak
+        async with limiter.acquire(10):
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+    
+    async def run():
+        await asyncio.gather(*[request() for _ in range(6)])
+    
+    asyncio.run(run())
+    assert peak == 2
+    assert limiter.in_flight == 0
+
+
+def test_rate_limit_retry_after_reads_status_and_header():
+    assert llm_classifier._rate_limit_retry_after(_RateLimited('3')) == (True, 3.0)
+    assert llm_classifier._rate_limit_retry_after(_RateLimited('soon')) == (True, None)
+    assert llm_classifier._rate_limit_retry_after(ValueError()) == (False, None)
+
+
+def test_query_retries_after_rate_limit(classifier):
+    attempts = []
+    
+    async def query(prompt, instructions, max_tokens=400, tool=None):
+        attempts.append(prompt)
+        if len(attempts) == 1:
+            raise _RateLimited('0')
+        return '{"understanding": "ok", "confidence": 0.9}'
+    
+    classifier._query_llm = query
+    response = asyncio.run(classifier._query_llm_limited('p', 'i'))
+    assert response == '{"understanding": "ok", "confidence": 0.9}'
+    assert len(attempts) == 2
+    assert classifier._limiter.limit < classifier.PROVIDER_CONCURRENCY.get('mock', 4)
+
+
+CARD = {'tagName': 'div', 'className': 'card', 'text': 'Product card', 'rect': {}}
+
+
+def test_identical_prompts_share_one_request(classifier):
+    calls = 0
+    
+    async def query(prompt, instructions, max_tokens=400, tool=None):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return '{"understanding": "card", "confidence": 0.9}'
+    
+    classifier._query_llm = query
+    
+    async def run():
+        return await asyncio.gather(*[classifier.analyze_element(dict(CARD)) for _ in range(5)])
+    
+    results = asyncio.run(run())
+    assert calls == 1
+    assert all(result['understanding'] == 'card' for result in results)
+    assert classifier._inflight == {}
+
+
+def test_waiters_retry_when_the_leading_request_is_cancelled(classifier):
+    calls = 0
+    
+    async def query(prompt, instructions, max_tokens=400, tool=None):
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05 if calls == 1 else 0)
+        return '{"understanding": "card", "confidence": 0.9}'
+    
+    classifier._query_llm = query
+    
+    async def run():
+        leader = asyncio.create_task(classifier.analyze_element(dict(CARD)))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(classifier.analyze_element(dict(CARD)))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower
+    
+    result = asyncio.run(run())
+    assert result['understanding'] == 'card'
+    assert calls == 2
+    assert classifier._inflight == {}
+
+
+def test_packed_analysis_answers_each_element_in_order(classifier):
+    prompts = []
+    
+    async def query(prompt, instructions, max_tokens=400, tool=None):
+        prompts.append((prompt, max_tokens))
+        count = prompt.count('Element Details')
+        return json.dumps({'analyses': [
+            {'understanding': f'answer {n}', 'confidence': 0.8} for n in range(count)
+        ]})
+    
+    classifier._query_llm = query
+    elements = [{'tagName': 'div', 'className': f'c{n}', 'text': f'text {n}'} for n in range(7)]
+    results = asyncio.run(classifier.analyze_elements_packed(elements, pack_size=5))
+    
+    assert [max_tokens for _, max_tokens in prompts] == [2000, 800]
+    assert [r['understanding'] for r in results] == [f'answer {n}' for n in range(5)] + ['answer 0', 'answer 1']
+    # Packed answers are cached per element
+    prompts.clear()
+    assert asyncio.run(classifier.analyze_elements_packed(elements)) == results
+    assert prompts == []
+
+
+def test_packed_analysis_falls_back_per_element_on_mismatch(classifier):
+    calls = []
+    
+    async def query(prompt, instructions, max_tokens=400, tool=None):
+        calls.append(max_tokens)
+        if prompt.count('Element Details') > 1:
+            return '{"analyses": [{"understanding": "only one", "confidence": 0.8}]}'
+        return '{"understanding": "single", "confidence": 0.7}'
+    
+    classifier._query_llm = query
+    elements = [{'tagName': 'div', 'className': f'c{n}', 'text': f'text {n}'} for n in range(3)]
+    results = asyncio.run(classifier.analyze_elements_packed(elements))
+    
+    assert calls == [1200, 400, 400, 400]
+    assert [r['understanding'] for r in results] == ['single'] * 3
+
+
+@pytest.mark.parametrize('confidence, cached', [('"0.8"', True), ('null', False), ('"high"', False)])
+def test_non_numeric_confidence_is_returned_not_raised(classifier, confidence, cached):
+    async def query(prompt, instructions, max_tokens=400, tool=None):
+        return f'{{"understanding": "card", "confidence": {confidence}}}'
+    
+    classifier._query_llm = query
+    result = asyncio.run(classifier.analyze_element(dict(CARD)))
+    assert result['understanding'] == 'card'
+    assert bool(classifier.response_cache.exact) is cached
+
+
+def test_packed_answer_with_non_numeric_confidence_keeps_the_batch(classifier):
+    async def query(prompt, instructions, max_tokens=400, tool=None):
+        return json.dumps({'analyses': [
+            {'understanding': 'first', 'confidence': None},
+            {'understanding': 'second', 'confidence': 'high'},
+            {'understanding': 'third', 'confidence': 0.8},
+        ]})
+    
+    classifier._query_llm = query
+    elements = [{'tagName': 'div', 'className': f'c{n}', 'text': f'text {n}'} for n in range(3)]
+    results = asyncio.run(classifier.analyze_elements_packed(elements))
+    
+    assert [r['understanding'] for r in results] == ['first', 'second', 'third']
+    assert len(classifier.response_cache.exact) == 1
+
+
+def test_hosted_provider_without_key_falls_back_to_mock(monkeypatch, tmp_path):
+    monkeypatch.setenv('LLM_PROVIDER', 'openai')
+    monkeypatch.delenv('OPENAI_API_KEY', raising=False)
+    monkeypatch.setenv('LLM_CACHE_FILE', str(tmp_path / 'llm_cache.jsonl'))
+    classifier = FlexibleLLMClassifier()
+    
+    result = asyncio.run(classifier.analyze_element({'tagName': 'nav', 'text': 'Home'}))
+    assert result == classifier._mock_response({'tagName': 'nav', 'text': 'Home'})
+
+
+def test_classifiers_share_one_cache_per_file(monkeypatch, tmp_path):
+    monkeypatch.setenv('LLM_PROVIDER', 'mock')
+    path = tmp_path / 'shared.jsonl'
+    first = FlexibleLLMClassifier(cache_path=path)
+    second = FlexibleLLMClassifier(cache_path=tmp_path / '.' / 'shared.jsonl')
+    assert first.response_cache is second.response_cache
+    assert FlexibleLLMClassifier(cache_path=tmp_path / 'other.jsonl').response_cache is not first.response_cache